@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import sys
+import os
+import time
+import argparse
+import subprocess
+
+from io import BytesIO
+from types import SimpleNamespace
+
+from engraver import Logger,EngraverData,valuePair
+
+########################################################################
+
+def timed(func,repeat):
+    start=time.perf_counter()
+    for i in range(repeat):
+        res=func()
+    return res,(time.perf_counter()-start)*1000./repeat
+
+def report(rows,header):
+    widths=[max(len(str(r[i])) for r in rows+[header]) for i in range(len(header))]
+    for r in [header]+rows:
+        print("  ".join(str(c).rjust(w) for c,w in zip(r,widths)))
+
+def previewArgs(size,contrast=None):
+    return SimpleNamespace(size=size,trf=None,contrast=contrast,brightness=None,gamma=None,levels=None,lim=1575,dummy=None)
+
+########################################################################
+
+def benchPreview(opts):
+    """compares the PNG encoding of 1-bit previews of the gui"""
+    from PIL import Image
+    import gui
+    src=Image.open(opts.image)
+    src.load()
+    src=EngraverData.preprocessImage(src,None)
+    img=EngraverData.processImage(src.copy(),previewArgs(opts.size))
+
+    def current():
+        fd=BytesIO()
+        img.save(fd,"png")
+        return fd.getvalue()
+
+    def fast():
+        fd=gui.EncodePNG(img)
+        with fd.getbuffer() as buf:
+            return len(buf)
+
+    cache=gui.PNGCache()
+    key=('image',0,opts.size)
+    def cached():
+        fd=cache.get(key)
+        if not fd:
+            fd=gui.EncodePNG(img)
+            cache.put(key,fd)
+        with fd.getbuffer() as buf:
+            return len(buf)
+
+    rows=[]
+    data,ms=timed(current,opts.repeat)
+    rows.append(('default png',len(data),"%.2f"%ms))
+    n,ms=timed(fast,opts.repeat)
+    rows.append(('level %d, no copy'%gui.PNG_LEVEL,n,"%.2f"%ms))
+    n,ms=timed(cached,opts.repeat)
+    rows.append(('cached',n,"%.2f"%ms))
+    print("preview %dx%d"%img.size)
+    report(rows,('path','bytes','ms/preview'))
+
+# commands whose startup is measured and modules they must not import
+STARTUP=(
+    ('engraver.py -v --dry-run',['engraver.py','-v','--dry-run'],('PIL','serial')),
+    ('engraver.py -h',['engraver.py','-h'],('PIL','serial')),
+    ('import gui',['-c','import gui'],('webbrowser','serial')),
+    )
+
+def importTimes(cmd):
+    """runs the command with -X importtime; returns the cumulative import time
+    (ms) of the top level modules and the wall time"""
+    start=time.perf_counter()
+    res=subprocess.run([sys.executable,'-X','importtime']+cmd,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE,
+                       cwd=os.path.dirname(os.path.abspath(__file__)),universal_newlines=True)
+    wall=(time.perf_counter()-start)*1000.
+    modules={}
+    for line in res.stderr.splitlines():
+        if line.startswith('import time:') and not line.endswith('imported package'):
+            _,cumulative,name=line.split('|')
+            modules[name.strip()]=(int(cumulative),name[1:2]!=' ')
+    return sum(c for c,top in modules.values() if top)/1000.,wall,modules
+
+def benchStartup(opts):
+    """measures the startup time of the tools; fails if unwanted modules are imported"""
+    rows=[]
+    failed=False
+    for name,cmd,unwanted in STARTUP:
+        runs=[importTimes(cmd) for i in range(max(1,min(opts.repeat,5)))]
+        loaded=[m for m in unwanted if m in runs[0][2]]
+        failed=failed or bool(loaded)
+        rows.append((name,"%.1f"%min(r[0] for r in runs),"%.1f"%min(r[1] for r in runs),','.join(loaded) or '-'))
+    report(rows,('command','imports ms','wall ms','unwanted imports'))
+    if failed:
+        print("startup regression: unwanted modules are imported")
+        sys.exit(1)
+
+def benchTransfer(opts):
+    """sends the image to a simulated engraver answering with the timing of a
+    recorded trace (see serialtrace.py)"""
+    from PIL import Image
+    from engraver import Engraver,SerialTransport
+    from serialtrace import Replayer
+    if not opts.trace:
+        print("transfer: a trace recorded with --record is required (-t)")
+        sys.exit(1)
+    args=previewArgs(opts.size)
+    args.power=50
+    args.depth=10
+    args.invert=False
+    args.device=args.record=None
+    args.speed=115200
+    src=Image.open(opts.image)
+    src.load()
+    data=EngraverData.fromBitmap(EngraverData.processImage(EngraverData.preprocessImage(src,None),args),args)
+    rows=[]
+    for i in range(max(1,min(opts.repeat,3))):
+        engraver=Engraver(args)
+        engraver.ser=Replayer(opts.trace,timeout=0.1)
+        engraver.transport=SerialTransport(engraver.ser)
+        engraver.opened=True
+        start=time.perf_counter()
+        data.sendData(engraver)
+        secs=time.perf_counter()-start
+        engraver.close()
+        rows.append((i+1,len(data.rows),"%.2f"%secs,"%.2f"%(secs*1000./max(1,len(data.rows))),engraver.ser.mismatches))
+    report(rows,('run','rows','secs','ms/row','mismatches'))
+
+########################################################################
+
+BENCHMARKS={
+    'preview':benchPreview,
+    'startup':benchStartup,
+    'transfer':benchTransfer,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmarks for the engraver software',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('benchmark',choices=sorted(BENCHMARKS.keys()),nargs='+')
+    parser.add_argument('-i','--image',metavar='imagefile',help='the image used for image benchmarks',default='web/logo.png')
+    parser.add_argument('-S','--maxsize',metavar='w:h',dest='size',type=valuePair,default=(1575,1575),
+                        help='the size images are scaled to')
+    parser.add_argument('-t','--trace',metavar='tracefile',help='the serial trace replayed by the transfer benchmark',default=None)
+    parser.add_argument('-r','--repeat',metavar='n',type=int,default=20,help='number of repetitions')
+    opts=parser.parse_args()
+    Logger.set(Logger(-1))
+    for b in opts.benchmark:
+        BENCHMARKS[b](opts)
@@ -15,13 +15,20 @@
 #
 ########################################################################
 
-import serial
 import argparse
 import sys
 import time
+import threading
+import queue
+import collections
 import re
 import os
-from PIL import Image,ImageDraw,ImageFont,ImageEnhance
+import math
+import functools
+import json
+import copy
+import hashlib
+import bisect
 
 VER = sys.version_info
 if VER[0]<3:
@@ -89,6 +96,134 @@ class Logger(object):
     def set(cls,logger):
         cls.LOGGER=logger
 
+
+class Metrics(object):
+    """counters and histograms in the Prometheus text format. Every thread updates
+    its own shard, so updates need no lock; the shards are summed on export"""
+    METRICS=None
+    BUCKETS=(0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.,2.5,5.,10.,30.,60.,300.,1800.,7200.)
+    HELP={
+        'kkengraver_http_request_seconds':'time to answer a HTTP request',
+        'kkengraver_render_seconds':'time spent in a stage of the image pipeline',
+        'kkengraver_cache_requests_total':'lookups in the caches',
+        'kkengraver_serial_bytes_total':'bytes transferred over the serial line',
+        'kkengraver_rows_sent_total':'image rows sent to the engraver',
+        'kkengraver_ack_seconds':'time until the engraver acknowledged a command',
+        'kkengraver_burn_seconds':'duration of a burn',
+        'kkengraver_burns_total':'burns by result',
+        'kkengraver_log_messages_total':'log messages by severity',
+        }
+
+    def __init__(self):
+        self.local=threading.local()
+        self.shards=[]
+        self.types={}
+        self.gauges={}
+        self.lock=threading.Lock() # only taken when a thread creates its shard
+
+    @classmethod
+    def set(cls,metrics):
+        cls.METRICS=metrics
+
+    @classmethod
+    def get(cls):
+        if cls.METRICS==None:
+            cls.METRICS=Metrics()
+        return cls.METRICS
+
+    def _shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard=self.local.shard={}
+            with self.lock:
+                self.shards.append(shard)
+            return shard
+
+    def inc(self,name,value=1,**labels):
+        key=(name,tuple(sorted(labels.items())))
+        shard=self._shard()
+        shard[key]=shard.get(key,0)+value
+        self.types[name]='counter'
+
+    def observe(self,name,value,**labels):
+        """adds a value to a histogram"""
+        key=(name,tuple(sorted(labels.items())))
+        shard=self._shard()
+        hist=shard.get(key)
+        if hist==None:
+            hist=shard[key]=[0]*(len(self.BUCKETS)+2) # counts per bucket and +Inf, sum
+            self.types[name]='histogram'
+        hist[bisect.bisect_left(self.BUCKETS,value)]+=1
+        hist[-1]+=value
+
+    def gauge(self,name,func,help):
+        """registers a gauge; func is called on export"""
+        self.gauges[name]=(func,help)
+
+    def timer(self,name,**labels):
+        """returns a context manager observing the time spent in its block"""
+        return _MetricsTimer(self,name,labels)
+
+    @staticmethod
+    def _labels(labels,extra=()):
+        labels=tuple(labels)+tuple(extra)
+        if not labels:
+            return ''
+        return '{%s}'%','.join('%s="%s"'%(k,str(v).replace('\\','\\\\').replace('"','\\"')) for k,v in labels)
+
+    def export(self):
+        totals={}
+        with self.lock:
+            shards=list(self.shards)
+        for shard in shards:
+            for key,val in list(shard.items()):
+                if isinstance(val,list):
+                    acc=totals.setdefault(key,[0]*len(val))
+                    for i,v in enumerate(val):
+                        acc[i]+=v
+                else:
+                    totals[key]=totals.get(key,0)+val
+        lines=[]
+        for name in sorted(set(k[0] for k in totals)):
+            lines.append('# HELP %s %s'%(name,self.HELP.get(name,name)))
+            lines.append('# TYPE %s %s'%(name,self.types[name]))
+            for key in sorted(k for k in totals if k[0]==name):
+                val=totals[key]
+                if isinstance(val,list):
+                    count=0
+                    for le,n in zip(self.BUCKETS+('+Inf',),val):
+                        count+=n
+                        lines.append('%s_bucket%s %d'%(name,self._labels(key[1],(('le',le if le=='+Inf' else '%g'%le),)),count))
+                    lines.append('%s_sum%s %s'%(name,self._labels(key[1]),self._value(val[-1])))
+                    lines.append('%s_count%s %d'%(name,self._labels(key[1]),count))
+                else:
+                    lines.append('%s%s %s'%(name,self._labels(key[1]),self._value(val)))
+        for name,(func,help) in sorted(self.gauges.items()):
+            lines.append('# HELP %s %s'%(name,help))
+            lines.append('# TYPE %s gauge'%name)
+            lines.append('%s %s'%(name,self._value(func())))
+        return '\n'.join(lines)+'\n'
+
+    @staticmethod
+    def _value(val):
+        """formats a sample without losing precision; %g would round large counters"""
+        return '%d'%val if isinstance(val,int) else repr(float(val))
+
+
+class _MetricsTimer(object):
+    def __init__(self,metrics,name,labels):
+        self.metrics=metrics
+        self.name=name
+        self.labels=labels
+
+    def __enter__(self):
+        self.start=time.perf_counter()
+        return self
+
+    def __exit__(self,*exc):
+        self.metrics.observe(self.name,time.perf_counter()-self.start,**self.labels)
+
 ########################################################################
 
 class Base(object):
@@ -141,20 +276,47 @@ class EngraverData(Base):
     EPILOG1=[0x0a,0x00,0x04,0x00]
     EPILOG2=[0x24,0x00,0x04,0x00,0x24,0x00,0x04,0x00]
     
-    def __init__(self,sizex,sizey,args):
+    def __init__(self,sizex,sizey,args,depth=None,offset=(0,0),extent=None):
         Base.__init__(self,args)        
         self.header=self.HEADER[:]
         self._size=(sizex,sizey)
+        self.depth=self.limit(args.depth if depth==None else depth,100,0)
+        self.power=self.limit(args.power,100,0)
         self.setValue(self.header,self.X_IDX,sizex)
         self.setValue(self.header,self.Y_IDX,sizey)
-        self.header[self.DEPTH_IDX]=self.limit(args.depth,100,0)
-        self.setValue(self.header,self.POW_IDX,self.limit(args.power,100,0)*10)
+        self.header[self.DEPTH_IDX]=self.depth
+        self.setValue(self.header,self.POW_IDX,self.power*10)
         #self.setValue(self.header,self.EXT1_IDX,self.limit(args.ext,2048,0))
         #self.setValue(self.header,self.EXT2_IDX,self.limit(args.ext,2048,0))
+        self.offset=offset  # position of the data relative to the reference point
+        self.extent=extent or self._size # size of the whole artwork (used for centering)
         self.rows=[]
+        self.skipped=0 # rows already burned when resuming
+        self._stats=None
 
     def size(self):
         return self._size
+
+    def stats(self):
+        """row statistics used for estimating the engraving time"""
+        if self._stats==None:
+            dark=runs=0
+            for row in self.rows:
+                d,r=self._burnCounts(row[3:-1])
+                dark+=d
+                runs+=r
+            self._stats={'rows':len(self.rows),'width':self._size[0],'bytes':sum(len(r) for r in self.rows),
+                         'dark':dark,'runs':runs,'depth':self.depth,'power':self.power}
+        return self._stats
+
+    def estimate(self):
+        return estimateBurnTime(self.stats())
+
+    @staticmethod
+    def _burnCounts(data):
+        """returns the number of pixels to burn and of burn runs of packed row data"""
+        burn=~int.from_bytes(bytes(data),'big')&((1<<(8*len(data)))-1)
+        return (bin(burn).count('1'),bin(burn&~(burn>>1)).count('1'))
     
     def addRow(self,data):
         row=[0x22,0,0]+data
@@ -168,20 +330,44 @@ class EngraverData(Base):
             self.debug("rowdata: %s\n",ldata)
         self.rows.append(row)
         
-    def sendData(self,engraver):
+    def hash(self):
+        """identifies the job for checking a checkpoint"""
+        h=hashlib.sha1(("%d:%d:"%self.offset).encode())
+        h.update(bytes(self.header))
+        for row in self.rows:
+            h.update(bytes(row))
+        return h.hexdigest()
+
+    def remainder(self,start):
+        """returns the job without the first start rows; the offset is shifted accordingly"""
+        rest=copy.copy(self)
+        rest.rows=self.rows[start:]
+        rest.header=self.header[:]
+        rest._size=(self._size[0],len(rest.rows))
+        self.setValue(rest.header,self.Y_IDX,len(rest.rows))
+        rest.offset=(self.offset[0],self.offset[1]+start)
+        rest.skipped=self.skipped+start
+        rest._stats=None
+        return rest
+
+    def sendData(self,engraver,progress=None):
         self.info("waiting for engraver\n")
         engraver.send(self.header,self.HEADER_ACK)
         total=len(self.rows)
         self.info("sending data (%d rows) ...\n"%total)
         per=0
         ri=0
+        metrics=Metrics.get()
         for row in self.rows:
             engraver.send(row)
+            metrics.inc('kkengraver_rows_sent_total')
             ri+=100
             cper=ri//total
             if per!=cper:
                 per=cper
                 self.info("\rsending: % 2d%% done",per)
+                if progress:
+                    progress(ri//100,0)
         self.info("\n")
                 
         engraver.send(self.EPILOG1)
@@ -191,14 +377,45 @@ class EngraverData(Base):
     #######
     #
 
+    # the transpositions as matrices (a,b,c,d) acting on centered pixel coordinates:
+    # x'=a*x+b*y, y'=c*x+d*y (y pointing down)
+    DIHEDRAL={None:(1,0,0,1),
+              'FLIP_LEFT_RIGHT':(-1,0,0,1),
+              'FLIP_TOP_BOTTOM':(1,0,0,-1),
+              'ROTATE_90':(0,1,-1,0),
+              'ROTATE_180':(-1,0,0,-1),
+              'ROTATE_270':(0,-1,1,0),
+              'TRANSPOSE':(0,1,1,0),
+              'TRANSVERSE':(0,-1,-1,0)}
+    # transpositions which can be applied to the packed rows
+    PACKED_FLIPS={'FLIP_LEFT_RIGHT':'lr','FLIP_TOP_BOTTOM':'tb','ROTATE_180':'turn'}
+    REVBITS=bytes(int('{:08b}'.format(i)[::-1],2) for i in range(256))
+
     @staticmethod
-    def _trfImage(im,args):
-        if args.trf:
-            for t in args.trf:
-                Logger.LOGGER.debug("transforming image:%s\n",t[0])
-                im=im.transpose(t[1])
+    def _composeTrf(trf):
+        """reduces a list of transformations to a single transposition (its name)"""
+        from PIL import Image
+        names={getattr(Image,n):n for n in EngraverData.DIHEDRAL if n}
+        m=EngraverData.DIHEDRAL[None]
+        for t in trf or ():
+            a,b,c,d=EngraverData.DIHEDRAL[names[t[1]]]
+            m=(a*m[0]+b*m[2],a*m[1]+b*m[3],c*m[0]+d*m[2],c*m[1]+d*m[3])
+        for name,mat in EngraverData.DIHEDRAL.items():
+            if mat==m:
+                return name
+
+    @staticmethod
+    def _transpose(im,op):
+        from PIL import Image
+        if op:
+            Logger.LOGGER.debug("transforming image:%s\n",op)
+            im=im.transpose(getattr(Image,op))
         return im
 
+    @staticmethod
+    def _trfImage(im,args):
+        return EngraverData._transpose(im,EngraverData._composeTrf(args.trf))
+
     @staticmethod
     def _removeAlpha(img):
         for i,px in enumerate(img.getdata()):
@@ -211,48 +428,280 @@ class EngraverData(Base):
 
     @staticmethod
     def _imageToData(im,args):
-        data=True
+        from PIL import Image
         if args.size and args.size!=im.size:
             im.thumbnail(args.size)
             Logger.LOGGER.info("image resized to width:%s height:%s\n",formatUnit(im.width),formatUnit(im.height))
         Logger.LOGGER.info("preparing image data width:%s height:%s\n",formatUnit(im.width),formatUnit(im.height))
+        if args.layers:
+            return EngraverData._layersToData(im,args)
+        im=EngraverData._enhanceImage(im,args)
         im=im.convert('1',dither=Image.FLOYDSTEINBERG) # to black and white        
-        im=EngraverData._trfImage(im,args)
-        if args.dummy:
-            if args.dummy!=".":
-                im.save(args.dummy)
+        op=EngraverData._composeTrf(args.trf)
+        kw={}
+        if not (args.orient or args.tile!=None or args.dummy and args.dummy!="."):
+            kw['flip']=EngraverData.PACKED_FLIPS.get(op) # flipped while packing the rows
+        if not kw.get('flip'):
+            im=EngraverData._transpose(im,op)
+        if args.orient:
+            im,kw['offset'],kw['extent']=EngraverData._autoOrient(im,args)
+        tiled=args.tile!=None and max(im.size)>args.lim
+        if tiled:
+            tiles=EngraverData._tiles(im,args)
+        if args.dummy and args.dummy!=".":
+            im.save(args.dummy)
+        if tiled:
+            return EngraverData._tilesToData(im,tiles,args,**kw)
+        return EngraverData.fromBitmap(im,args,**kw)
+
+    ORIENTATIONS=(('none',None),('cw','ROTATE_270'),('ccw','ROTATE_90'),('turn','ROTATE_180'))
+
+    @staticmethod
+    def _trim(im,inv):
+        """returns the bounding box of the pixels to burn"""
+        return (im if inv else im.point(lambda v:255-v)).getbbox()
+
+    @staticmethod
+    def _orientCost(im,args):
+        """returns the statistics of the bitmap without building the job"""
+        dark=runs=0
+        for row in EngraverData._packRows(im,args.invert):
+            d,r=EngraverData._burnCounts(row)
+            dark+=d
+            runs+=r
+        return {'rows':im.height,'width':im.width,'bytes':im.height*(((im.width+7)>>3)+4),
+                'dark':dark,'runs':runs,'depth':args.depth,'power':args.power}
+
+    @staticmethod
+    def _autoOrient(im,args):
+        """rotates the image to the orientation with the lowest estimated burn time;
+        blank borders are trimmed. Returns the image, its offset and the extent"""
+        from PIL import Image
+        best=None
+        Logger.LOGGER.info("orientation     rows     bytes  estimated time\n")
+        for name,trf in EngraverData.ORIENTATIONS:
+            rim=im.transpose(getattr(Image,trf)) if trf!=None else im
+            bbox=EngraverData._trim(rim,args.invert) or (0,0)+rim.size
+            cost=EngraverData._orientCost(rim.crop(bbox),args)
+            secs=estimateBurnTime(cost)
+            Logger.LOGGER.info("%-11s% 9d% 10d  %s\n",name,cost['rows'],cost['bytes'],formatTime(secs))
+            if best==None or (secs,cost['bytes'])<best[0]:
+                best=((secs,cost['bytes']),name,rim,bbox)
+        _,name,rim,bbox=best
+        Logger.LOGGER.info("using orientation: %s\n",name)
+        return (rim.crop(bbox),bbox[:2],rim.size)
+
+    @staticmethod
+    def _tiles(im,args):
+        """splits the image into tiles of at most args.lim steps overlapping by
+        args.tile steps; the order of the tiles is meandering to minimize travel"""
+        step=args.lim-args.tile
+        if step<=0:
+            Logger.LOGGER.fatal("the tile overlap must be smaller than the limit %d\n",args.lim)
+        xs=list(range(0,max(im.width-args.tile,1),step))
+        ys=list(range(0,max(im.height-args.tile,1),step))
+        tiles=[]
+        for r,y in enumerate(ys):
+            for x in (xs if r%2==0 else reversed(xs)):
+                tiles.append((x,y,min(x+args.lim,im.width),min(y+args.lim,im.height)))
+        Logger.LOGGER.info("splitting image into %d tiles (%dx%d)\n",len(tiles),len(xs),len(ys))
+        for i,t in enumerate(tiles):
+            Logger.LOGGER.info("tile %d: x:%s y:%s width:%s height:%s\n",i+1,formatUnit(t[0]),formatUnit(t[1]),
+                               formatUnit(t[2]-t[0]),formatUnit(t[3]-t[1]))
+        return tiles
+
+    @staticmethod
+    def _tilesToData(im,tiles,args,offset=(0,0),extent=None):
+        """generates the data of the tiles one at a time; blank tiles are skipped"""
+        blank=(0,0) if args.invert else (255,255)
+        for t in tiles:
+            tile=im.crop(t)
+            if tile.getextrema()!=blank:
+                yield EngraverData.fromBitmap(tile,args,offset=(offset[0]+t[0],offset[1]+t[1]),extent=extent or im.size)
+
+    @staticmethod
+    def _nestItem(item,args):
+        """loads a single item for nesting: an image file or 'text:<text>'"""
+        from PIL import Image
+        if item.startswith('text:'):
+            if not args.font:
+                Logger.LOGGER.fatal("no font is given for item '%s'; please use --font\n",item)
+            targs=argparse.Namespace(**vars(args))
+            targs.text=item[5:]
+            im=EngraverData.imageFromText(targs)
         else:
-            data=EngraverData(im.width,im.height,args)
-            inv=args.invert
-            bytesInRow=(im.width+7)>>3
-            for i in range(im.height):
-                row=bytesInRow*[0xff]
-                for j in range(im.width):
-                    bitno=7-(j&7)
-                    bitval=inv ^ (im.getpixel((j,i))!=0)
-                    idx=j>>3
-                    row[idx]=(row[idx]&~(1<<bitno))|(bitval<<bitno)
-                data.addRow(row)
+            im=Image.open(item)
+            im.load()
+            im=EngraverData.preprocessImage(im,args)
+            if args.size and args.size!=im.size:
+                im.thumbnail(args.size)
+        im=im.convert('1',dither=Image.FLOYDSTEINBERG)
+        if args.invert:
+            im=im.point(lambda v:255-v)
+        return EngraverData._trfImage(im,args)
+
+    @staticmethod
+    def _skyline(sizes,width,height):
+        """packs rectangles into width x height with the skyline bottom-left
+        heuristic; returns the positions (None for rectangles which do not fit)"""
+        sky=[(0,0,width)] # segments x,y,w
+        pos=[None]*len(sizes)
+        for i in sorted(range(len(sizes)),key=lambda i:(-sizes[i][1],-sizes[i][0])):
+            w,h=sizes[i]
+            best=None
+            for j,(x,_,_) in enumerate(sky):
+                if x+w>width:
+                    break
+                y=0
+                k=j
+                while sky[k][0]<x+w:
+                    y=max(y,sky[k][1])
+                    k+=1
+                    if k==len(sky):
+                        break
+                if y+h<=height and (best==None or (y+h,x)<(best[1]+h,best[0])):
+                    best=(x,y)
+            if best==None:
+                continue
+            pos[i]=best
+            x,y=best
+            nsky=[]
+            for sx,sy,sw in sky:
+                if sx+sw<=x or sx>=x+w:
+                    nsky.append((sx,sy,sw))
+                    continue
+                if sx<x:
+                    nsky.append((sx,sy,x-sx))
+                if sx+sw>x+w:
+                    nsky.append((x+w,sy,sx+sw-x-w))
+            nsky.append((x,y+h,w))
+            nsky.sort()
+            sky=[]
+            for seg in nsky: # merge neighbours of equal height
+                if sky and sky[-1][1]==seg[1] and sky[-1][0]+sky[-1][2]==seg[0]:
+                    sky[-1]=(sky[-1][0],seg[1],sky[-1][2]+seg[2])
+                else:
+                    sky.append(seg)
+        return pos
+
+    @staticmethod
+    def fromItems(args):
+        """nests the images/texts given by args.nest onto the bed and composes
+        them into a single job"""
+        from PIL import Image
+        items=[EngraverData._nestItem(item,args) for item in args.nest]
+        gap=args.gap
+        pos=EngraverData._skyline([(im.width+gap,im.height+gap) for im in items],args.lim+gap,args.lim+gap)
+        placed=[(im,p,item) for im,p,item in zip(items,pos,args.nest) if p!=None]
+        for im,p,item in zip(items,pos,args.nest):
+            if p==None:
+                Logger.LOGGER.warn("item '%s' (width:%s height:%s) does not fit onto the bed; skipped\n",
+                                   item,formatUnit(im.width),formatUnit(im.height))
+        if not placed:
+            Logger.LOGGER.error("no item fits onto the bed\n")
+            return None
+        width=max(p[0]+im.width for im,p,_ in placed)
+        height=max(p[1]+im.height for im,p,_ in placed)
+        bed=Image.new('1',(width,height),1)
+        for im,p,item in placed:
+            Logger.LOGGER.info("item '%s': x:%s y:%s width:%s height:%s\n",item,formatUnit(p[0]),formatUnit(p[1]),
+                               formatUnit(im.width),formatUnit(im.height))
+            bed.paste(im,p)
+        area=sum(im.width*im.height for im,_,_ in placed)
+        Logger.LOGGER.info("nested %d of %d items into width:%s height:%s; utilisation %.1f%% of the job, %.1f%% of the bed\n",
+                           len(placed),len(items),formatUnit(width),formatUnit(height),
+                           100.*area/(width*height),100.*area/(args.lim*args.lim))
+        if args.dummy and args.dummy!=".":
+            bed.save(args.dummy)
+        return EngraverData.fromBitmap(bed,args,invert=False)
+
+    @staticmethod
+    def _packRows(im,inv,flip=None):
+        """packs the rows of a 1-bit image; a set bit means: do not burn.
+        The rows can be flipped (lr, tb or turn) while packing"""
+        bytesInRow=(im.width+7)>>3
+        raw=im.tobytes()
+        if inv:
+            raw=bytes(0xff^b for b in raw)
+        shift=bytesInRow*8-im.width
+        pad=(1<<shift)-1
+        mask=(1<<(8*bytesInRow))-1
+        starts=range(0,len(raw),bytesInRow)
+        if flip in ('tb','turn'):
+            starts=reversed(starts)
+        for i in starts:
+            row=raw[i:i+bytesInRow]
+            if flip in ('lr','turn'): # reverse the bits; the padding moves to the front
+                row=row.translate(EngraverData.REVBITS)[::-1]
+                if shift:
+                    row=((int.from_bytes(row,'big')<<shift)&mask).to_bytes(bytesInRow,'big')
+            row=list(row)
+            row[-1]|=pad
+            yield row
+
+    @staticmethod
+    def fromBitmap(im,args,invert=None,flip=None,**kw):
+        data=EngraverData(im.width,im.height,args,**kw)
+        for row in EngraverData._packRows(im,args.invert if invert==None else invert,flip):
+            data.addRow(row)
         return data
 
     @staticmethod
-    def _crop(img):
-        bbox=(img.width-1,img.height-1,0,0)
-        for i,px in enumerate(img.getdata()):
-            if px!=(255,255,255):
-                x=i%img.width
-                y=i//img.width
-                bbox=(min(bbox[0],x-1),min(bbox[1],y-1),max(bbox[2],x+1),max(bbox[3],y+1))
-        return img.crop(bbox)
+    def _layersToData(im,args):
+        """quantizes the grayscale image into args.layers depth levels; every level
+        becomes its own job cropped to the pixels of that level"""
+        im=EngraverData._enhanceImage(im.convert('L'),args)
+        im=EngraverData._trfImage(im,args)
+        n=args.layers
+        if args.invert:
+            level=[(v*n+127)//255 for v in range(256)]
+        else:
+            level=[((255-v)*n+127)//255 for v in range(256)]
+        layers=[]
+        for l in range(1,n+1):
+            bbox=im.point([255 if q==l else 0 for q in level]).getbbox()
+            if not bbox:
+                continue
+            layer=im.crop(bbox).point([0 if q==l else 255 for q in level],'1')
+            depth=max(1,(args.depth*l+n//2)//n)
+            data=EngraverData.fromBitmap(layer,args,invert=False,depth=depth,offset=bbox[:2],extent=im.size)
+            Logger.LOGGER.info("layer %d: depth %d, %s rows, offset x:%s y:%s, estimated time %s\n",l,depth,
+                               data.stats()['rows'],formatUnit(bbox[0]),formatUnit(bbox[1]),formatTime(data.estimate()))
+            if args.dummy and args.dummy!=".":
+                base,ext=os.path.splitext(args.dummy)
+                layer.save("%s-layer%d%s"%(base,l,ext or '.png'))
+            layers.append(data)
+        Logger.LOGGER.info("estimated time for all layers: %s\n",formatTime(sum(d.estimate() for d in layers)))
+        return layers
+
+    @staticmethod
+    def _thumbnailSize(size,maxsize):
+        """the size Image.thumbnail(maxsize) results in"""
+        x,y=(math.floor(v) for v in maxsize)
+        w,h=size
+        if x>=w and y>=h:
+            return size
+        aspect=w/h
+        def roundAspect(number,key):
+            return max(min(math.floor(number),math.ceil(number),key=key),1)
+        if x/y>=aspect:
+            x=roundAspect(y*aspect,key=lambda n:abs(aspect-n/y))
+        else:
+            y=roundAspect(x/aspect,key=lambda n:0 if n==0 else abs(aspect-x/n))
+        return (x,y)
 
     @staticmethod
     def imageFrame(args):
-        im=Image.open(args.image)
-        im.load()
+        """returns the size of the image as it is engraved; only the header of
+        the image file is read"""
+        from PIL import Image
+        with Image.open(args.image) as im:
+            size=im.size
         if args.size:
-            im.thumbnail(args.size)
-        im=EngraverData._trfImage(im,args)
-        return im.size
+            size=EngraverData._thumbnailSize(size,args.size)
+        if EngraverData.DIHEDRAL[EngraverData._composeTrf(args.trf)][1]: # axes are swapped
+            size=size[::-1]
+        return size
     
     @staticmethod
     def checkerboard(args):
@@ -274,25 +723,39 @@ class EngraverData(Base):
 
     @staticmethod
     def _enhanceImage(im,args):
-        if args.contrast!=None or args.brightness!=None:
-            im=im.convert('L')
-        if args.contrast!=None:
-            Logger.LOGGER.info("applying contrast value:%f\n",args.contrast)
-            enhancer=ImageEnhance.Contrast(im)
-            im=enhancer.enhance(args.contrast)
+        """applies auto-levels, contrast, brightness and gamma with a single lookup table"""
+        if args.levels==None and args.contrast==None and args.brightness==None and args.gamma==None:
+            return im
+        im=im.convert('L')
+        lo,hi,mean=(0,255,None)
+        if args.levels!=None or args.contrast!=None:
+            hist=im.histogram()
+            if args.levels!=None:
+                lo,hi=levelsRange(hist,args.levels)
+                Logger.LOGGER.info("applying auto levels: %d..%d\n",lo,hi)
+            if args.contrast!=None:
+                lut=toneTable(None,None,None,lo,hi,None)
+                mean=int(sum(n*lut[v] for v,n in enumerate(hist))/max(1,sum(hist))+0.5)
+                Logger.LOGGER.info("applying contrast value:%f\n",args.contrast)
         if args.brightness!=None:
             Logger.LOGGER.info("applying brightness value:%f\n",args.brightness)
-            enhancer=ImageEnhance.Brightness(im)
-            im=enhancer.enhance(args.brightness)
-        return im
+        if args.gamma!=None:
+            Logger.LOGGER.info("applying gamma value:%f\n",args.gamma)
+        return im.point(toneTable(args.contrast,args.brightness,args.gamma,lo,hi,mean))
     
     @staticmethod
     def processImage(im,args):
-        im=EngraverData._enhanceImage(im,args)
+        from PIL import Image
+        metrics=Metrics.get()
+        with metrics.timer('kkengraver_render_seconds',stage='enhance'):
+            im=EngraverData._enhanceImage(im,args)
         if args.size:
-            im.thumbnail(args.size)
-        im=im.convert('1',dither=Image.FLOYDSTEINBERG) # to black and white        
-        im=EngraverData._trfImage(im,args)
+            with metrics.timer('kkengraver_render_seconds',stage='thumbnail'):
+                im.thumbnail(args.size)
+        with metrics.timer('kkengraver_render_seconds',stage='dither'):
+            im=im.convert('1',dither=Image.FLOYDSTEINBERG) # to black and white        
+        with metrics.timer('kkengraver_render_seconds',stage='transform'):
+            im=EngraverData._trfImage(im,args)
         return im
 
     @staticmethod
@@ -305,52 +768,195 @@ class EngraverData(Base):
 
     @staticmethod
     def fromImage(args):
+        from PIL import Image
         im=Image.open(args.image)
         im.load()
         im=EngraverData.preprocessImage(im,args)
         return EngraverData._imageToData(im,args)
 
+    @staticmethod
+    def _lineWidth(font,line):
+        if hasattr(font,'getbbox'):
+            return font.getbbox(line)[2]
+        return font.getsize(line)[0] # Pillow<8
+
     @staticmethod
     def _textSize(font,text):
-        w,h=(0,0)
-        for l in text.split('\n'):
-            sz=font.getsize(l)
-            h+=sz[1]*1.2
-            w=max(w,sz[0])
-        return (w,h)
+        """returns the size of the text and the distance of its lines (1.2 times the line height)"""
+        ascent,descent=font.getmetrics()
+        lines=text.split('\n')
+        pitch=(ascent+descent)*1.2
+        w=max(EngraverData._lineWidth(font,l) for l in lines)
+        return (w,int(pitch*(len(lines)-1))+ascent+descent,pitch)
+
+    @staticmethod
+    def _renderText(font,text):
+        """renders the text black on white and crops it to the inked pixels"""
+        from PIL import Image,ImageDraw
+        w,h,pitch=EngraverData._textSize(font,text)
+        im=Image.new('L',(max(1,int(w)+1),max(1,h+1)),255)
+        draw=ImageDraw.Draw(im)
+        for i,l in enumerate(text.split('\n')):
+            draw.text((0,int(i*pitch)),l,0,font)
+        bbox=im.point(lambda v:255-v).getbbox()
+        return im.crop(bbox) if bbox else im
 
     @staticmethod
     def imageFromText(args):
+        """renders the text at the largest font size fitting into the engraving size"""
+        from PIL import ImageFont
         size=tuple(max(s,args.lim) if s==0 else s for s in args.size or (args.lim,args.lim))
-        mside=max(size)
-        maxw=min(mside*2,3072)
-        maxh=min(mside*2,3072)
-        im=Image.new("RGB",(maxw,maxh),(255,255,255))
-        fsz=12
-        text=" %s "%args.text
-        while True:
-            nfsz=(fsz*12)//10
-            font=ImageFont.truetype(args.font,nfsz)
-            sz=EngraverData._textSize(font,text)
-            if sz[0]>maxw or sz[1]>maxh:
-                font=ImageFont.truetype(args.font,fsz)
-                Logger.LOGGER.info("using font:%s\n",font.getname())
-                sz=EngraverData._textSize(font,text)
-                pos=((maxw-sz[0])//2,(maxh-sz[1])//2)
-                break
-            fsz=nfsz
-        draw=ImageDraw.Draw(im)
-        draw.text(pos,text,(0,0,0),font)
-        im=EngraverData._crop(im)
-        im.thumbnail(size)
-        Logger.LOGGER.info("text image resized to width:%s height:%s\n",formatUnit(im.width),formatUnit(im.height))
+        text=args.text
+        fsz=100
+        w,h,_=EngraverData._textSize(ImageFont.truetype(args.font,fsz),text)
+        fsz=max(1,int(fsz*min(size[0]/max(1,w),size[1]/max(1,h))))
+        best=None
+        tried=set()
+        while fsz not in tried: # the inked size is not exactly proportional to the font size
+            tried.add(fsz)
+            font=ImageFont.truetype(args.font,fsz)
+            im=EngraverData._renderText(font,text)
+            scale=min(size[0]/im.width,size[1]/im.height)
+            if scale>=1:
+                if not best or fsz>best[0]:
+                    best=(fsz,font,im)
+                fsz=int(fsz*scale)
+            else:
+                fsz=max(1,min(int(fsz*scale),fsz-1))
+        if best:
+            fsz,font,im=best
+        else:
+            im.thumbnail(size)
+        Logger.LOGGER.info("using font:%s size:%d\n",font.getname(),fsz)
+        Logger.LOGGER.info("text image width:%s height:%s\n",formatUnit(im.width),formatUnit(im.height))
         return im
     
                 
     @staticmethod
     def fromText(args):
-        return EngraverData._imageToData(imageFromText(args),args)
+        return EngraverData._imageToData(EngraverData.imageFromText(args),args)
+    
+
+########################################################################
+
+class SerialTransport(object):
+    """owns the serial device: a single reader thread demultiplexes the responses
+    of the engraver. Acknowledges resolve the futures of the requests in the order
+    they were sent; 4 byte frames (progress, completion) go to the frames queue
+    while burning. Writes are queued and done by a writer thread"""
+    FRAME_SIZE=4
     
+    def __init__(self,ser):
+        self.ser=ser
+        self.framing=False # progress frames are expected
+        self.frames=queue.Queue()
+        self.pending=collections.deque()
+        self.writes=queue.Queue()
+        self.lock=threading.Lock()
+        self.buf=b''
+        self.error=None
+        self.running=True
+        self.threads=[threading.Thread(target=self._reader,daemon=True),threading.Thread(target=self._writer,daemon=True)]
+        for t in self.threads:
+            t.start()
+
+    def write(self,data):
+        """queues the data; the future is resolved when the data is written"""
+        from concurrent.futures import Future
+        fut=Future()
+        self.writes.put((bytes(data),fut))
+        return fut
+
+    def request(self,data,size):
+        """writes the data; the future is resolved with the next size bytes of the response"""
+        from concurrent.futures import Future
+        fut=Future()
+        with self.lock:
+            if self.error:
+                fut.set_exception(self.error)
+                return fut
+            if not (self.pending or self.framing) and self.buf:
+                Logger.LOGGER.warn("read stale bytes from device: %s\n",self.buf)
+                self.buf=b''
+            self.pending.append((size,fut))
+        self.writes.put((bytes(data),None))
+        return fut
+
+    def cancel(self,fut):
+        """forgets a request that got no response in time; the bytes received
+        so far are discarded, so later responses are not taken for its answer"""
+        with self.lock:
+            for item in self.pending:
+                if item[1] is fut:
+                    self.pending.remove(item)
+                    break
+            self.buf=b''
+        fut.cancel()
+
+    def clearFrames(self):
+        try:
+            while True:
+                self.frames.get_nowait()
+        except queue.Empty:
+            pass
+
+    def close(self):
+        self.running=False
+        self.writes.put(None)
+        for t in self.threads:
+            t.join(1)
+
+    def _fail(self,ex):
+        with self.lock:
+            self.error=ex
+            while self.pending:
+                self.pending.popleft()[1].set_exception(ex)
+        self.frames.put(ex)
+
+    def _writer(self):
+        metrics=Metrics.get()
+        while True:
+            item=self.writes.get()
+            if item==None:
+                break
+            try:
+                self.ser.write(item[0])
+            except Exception as ex:
+                self._fail(ex)
+                break
+            metrics.inc('kkengraver_serial_bytes_total',len(item[0]),direction='tx')
+            if item[1]:
+                item[1].set_result(len(item[0]))
+
+    def _reader(self):
+        metrics=Metrics.get()
+        while self.running:
+            try:
+                data=self.ser.read(max(1,self.ser.in_waiting))
+            except Exception as ex:
+                if self.running:
+                    self._fail(ex)
+                break
+            if data:
+                metrics.inc('kkengraver_serial_bytes_total',len(data),direction='rx')
+                with self.lock:
+                    self.buf+=data
+                    self._dispatch()
+
+    def _dispatch(self):
+        while self.buf:
+            pend=self.pending[0] if self.pending else None
+            # while burning a single byte acknowledge is told apart from a frame by its value
+            if pend and (not self.framing or pend[0]>1 or self.buf[:1]==Base.ACK):
+                if len(self.buf)<pend[0]:
+                    return
+                self.pending.popleft()[1].set_result(self.buf[:pend[0]])
+                self.buf=self.buf[pend[0]:]
+            elif self.framing and len(self.buf)>=self.FRAME_SIZE:
+                self.frames.put(self.buf[:self.FRAME_SIZE])
+                self.buf=self.buf[self.FRAME_SIZE:]
+            else:
+                return
 
 ########################################################################
 
@@ -377,11 +983,17 @@ class Engraver(Base):
     CONNECTED=bytes([0x2,0x1,0x4])
     COMPLETED=bytes([0xff,0xff,0xff,0xff])
 
+    TIMEOUT=30 # secs to wait for a response
+
     def __init__(self,args):
         Base.__init__(self,args)
         self.device=args.device
         self.speed=args.speed
+        self.record=args.record
         self.ser=None
+        self.transport=None
+        self.interrupted=threading.Event()
+        self.burning=False
         self.opened=False
         self.connected=False
         self.firmware="unknown"
@@ -393,7 +1005,9 @@ class Engraver(Base):
             self.error("cannot open device %s more than once!\n",self.device)
             return
         try:
-            self.ser=serial.Serial(self.device, self.speed,timeout=30)
+            from serialtrace import openDevice
+            self.ser=openDevice(self.device,self.speed,self.record)
+            self.transport=SerialTransport(self.ser)
             self.opened=True
         except Exception as ex:
             self.fatal("%s\n",ex)
@@ -406,6 +1020,7 @@ class Engraver(Base):
     
     def close(self):
         if self.opened:
+            self.transport.close()
             self.ser.close()
             self.opened=False
         else:
@@ -415,19 +1030,42 @@ class Engraver(Base):
         if not self.connected:
             self.fatal("connection failed! Could not detect engraver!")
         
+    def _request(self,data,size):
+        from concurrent.futures import TimeoutError as FutureTimeout
+        fut=self.transport.request(data,size)
+        try:
+            return fut.result(self.TIMEOUT)
+        except FutureTimeout:
+            self.transport.cancel(fut)
+            self.fatal("no response from engraver\n")
+        except Exception as ex:
+            self.fatal("%s\n",ex)
+        return b''
+
+    def interrupt(self):
+        """pauses a running burn from another thread; the burning thread asks
+        whether to cancel; it is ignored if nothing is burning"""
+        if not self.burning:
+            return
+        self.interrupted.set()
+        if self.transport:
+            self.transport.frames.put(None)
+
     def send(self,data,exp=Base.ACK):
-        if self.ser.in_waiting>0:
-            stale=self.ser.read(self.ser.in_waiting)
-            self.warn("read stale bytes from device: %s\n",stale)
+        if self.burning and self.interrupted.is_set():
+            self.interrupted.clear()
+            raise KeyboardInterrupt
         self.debug("sending:%s\n",data)
-        self.ser.write(bytes(data))
         if exp!=None:
-            ack=self.ser.read(len(exp))
+            start=time.perf_counter()
+            ack=self._request(data,len(exp))
+            Metrics.get().observe('kkengraver_ack_seconds',time.perf_counter()-start)
             if ack==exp:
                 self.debug("got acknowledge\n")
             else:
                 self.fatal("didn't got acknowledge; got:%s\n",ack)
         else:
+            self.transport.write(data)
             self.debug("no acknowledge expected!\n")
 
     def fan(self,on):
@@ -447,10 +1085,12 @@ class Engraver(Base):
     
     def connect(self):
         self.debug("connecting...\n")
-        self.send(self.CONNECT)
-        resp=self.ser.read(3)
-        self.debug("response read:%s",resp)
-        self.firmware="%s.%s.%s"%(resp[0],resp[1],resp[2])
+        resp=self._request(self.CONNECT,len(self.ACK)+3)
+        if len(resp)!=4 or resp[:1]!=self.ACK:
+            self.fatal("didn't got acknowledge; got:%s\n",resp)
+            return
+        self.debug("response read:%s",resp[1:])
+        self.firmware="%s.%s.%s"%tuple(resp[1:])
         self.connected=True
         self._check()
         self.debug("...connected!")
@@ -470,10 +1110,18 @@ class Engraver(Base):
         
     def move(self,dx,dy):
         self.debug("start moving delta_x=%s delta_y=%s\n",formatUnit(dx),formatUnit(dy))
-        data=self.MOVE_XY[:]
-        self.setValue(data,self.X_IDX,dx)
-        self.setValue(data,self.Y_IDX,dy)
-        self.send(data)
+        rx,ry=dx,dy
+        while True: # a single move is restricted to the limit
+            sx=max(-self.lim,min(self.lim,rx))
+            sy=max(-self.lim,min(self.lim,ry))
+            data=self.MOVE_XY[:]
+            self.setValue(data,self.X_IDX,sx)
+            self.setValue(data,self.Y_IDX,sy)
+            self.send(data)
+            rx-=sx
+            ry-=sy
+            if not (rx or ry):
+                break
         self.debug("move finished\n")
         self.info("laser moved x:%s y:%s\n",formatUnit(dx),formatUnit(dy))
         
@@ -520,42 +1168,110 @@ class Engraver(Base):
         finally:
             engraver.frameStop(fx,fy,useCenter,centerAxis)
     
-    def burn(self,data,useCenter):
+    def _origin(self,data,useCenter):
+        dx,dy=data.offset
+        if useCenter:
+            w,h=data.extent
+            dx-=w//2
+            dy-=h//2
+        return (dx,dy)
+
+    def _frame(self):
+        """waits for the next progress frame of the engraver"""
+        while True:
+            try:
+                resp=self.transport.frames.get(timeout=self.TIMEOUT)
+            except queue.Empty:
+                self.warn("no progress reported by the engraver for %d secs\n",self.TIMEOUT)
+                continue
+            if resp==None: # interrupted
+                self.interrupted.clear()
+                raise KeyboardInterrupt
+            if isinstance(resp,Exception):
+                raise resp
+            return resp
+
+    def _burn(self,data,progress=None):
+        self.transport.clearFrames()
+        self.transport.framing=True
         try:
-            if useCenter:
-                dx,dy=data.size()
-                self.move(-dx//2,-dy//2)
-            data.sendData(self)
-            msg="\rcompleted!\n"
-            self.info("engraving...\n")
-            if self.logging("DEBUG"):
-                start=time.time()
-            perc=None
-            while True:
-                try:
-                    resp=self.ser.read(4)
-                    if resp==self.COMPLETED:
-                        self.info("\r100%% done")
-                        break
-                    if perc!=resp[3]:
-                        perc=resp[3]
-                        self.info("\r% 2d%% done",perc)
-                except KeyboardInterrupt:
-                    self.pause()
-                    time.sleep(5)
-                    if UI.ASK("Paused! Do you want to cancel the process?"):
-                        self.stop()
-                        msg="\rcanceled!\n"
-                        break
-                    self.cont()
-            if self.logging("DEBUG"):
-                self.debug("engraving time: %.1f secs\n",time.time()-start)
-            self.info(msg)
+            return self._burnData(data,progress)
+        except BaseException:
+            Metrics.get().inc('kkengraver_burns_total',result='failed')
+            raise
+        finally:
+            self.transport.framing=False
+
+    def _burnData(self,data,progress):
+        start=time.time()
+        data.sendData(self,progress)
+        transfer=time.time()-start
+        msg="\rcompleted!\n"
+        completed=True
+        self.info("engraving...\n")
+        perc=None
+        while True:
+            try:
+                resp=self._frame()
+                if resp==self.COMPLETED:
+                    self.info("\r100%% done")
+                    break
+                if perc!=resp[3]:
+                    perc=resp[3]
+                    self.info("\r% 2d%% done",perc)
+                    if progress:
+                        progress(len(data.rows),perc)
+            except KeyboardInterrupt:
+                self.pause()
+                time.sleep(5)
+                if UI.ASK("Paused! Do you want to cancel the process?"):
+                    self.stop()
+                    msg="\rcanceled!\n"
+                    completed=False
+                    break
+                self.cont()
+        burn=time.time()-start-transfer
+        self.debug("transfer time: %.1f secs, engraving time: %.1f secs\n",transfer,burn)
+        if completed:
+            BurnModel.get().record(data.stats(),transfer,burn)
+        result='completed' if completed else 'canceled'
+        Metrics.get().observe('kkengraver_burn_seconds',transfer+burn,result=result)
+        Metrics.get().inc('kkengraver_burns_total',result=result)
+        self.info(msg)
+        return completed
+
+    def burn(self,data,useCenter,checkpoint=None):
+        self.burnJobs([data] if isinstance(data,EngraverData) else data,useCenter,checkpoint)
+
+    def burnJobs(self,jobs,useCenter,checkpoint=None):
+        """burns the jobs one after another; the laser moves directly from one job
+        to the next and returns to the reference point at the end. The progress
+        is saved to the checkpoint if given"""
+        pos=(0,0)
+        if checkpoint and checkpoint.resuming:
+            jobs=checkpoint.remaining(jobs)
+        self.interrupted.clear()
+        self.burning=True
+        try:
+            for data in jobs:
+                target=self._origin(data,useCenter)
+                if target!=pos:
+                    self.move(target[0]-pos[0],target[1]-pos[1])
+                    pos=target
+                if checkpoint:
+                    checkpoint.start(data)
+                if not self._burn(data,checkpoint and (lambda sent,perc:checkpoint.progress(data,sent,perc))):
+                    break
+            else:
+                if checkpoint:
+                    checkpoint.clear()
         except KeyboardInterrupt:
             self.stop()
         finally:
-            if useCenter:
-                self.move(dx//2,dy//2)
+            self.burning=False
+            self.interrupted.clear()
+            if pos!=(0,0):
+                self.move(-pos[0],-pos[1])
 
 
 
@@ -577,7 +1293,200 @@ def unitValue(para):
 def formatUnit(val):
     return "%dpx (%.1fmm)"%(val,val/STEPS_PER_MM)
 
+def formatTime(secs):
+    return "%d:%02d min"%(secs//60,secs%60)
+
+HISTORY=os.path.join(os.path.expanduser('~'),'.kkengraver','history.jsonl')
+CHECKPOINT=os.path.join(os.path.expanduser('~'),'.kkengraver','checkpoint.json')
+
+class Checkpoint(object):
+    """saves the progress of the jobs being burned so that an interrupted
+    burn can be resumed with the remaining rows"""
+    def __init__(self,path,resume=False):
+        self.path=path
+        self.resuming=resume
+        self.state={'jobs':[],'sent':0,'percent':0,'burned':0}
+        if resume:
+            try:
+                with open(path) as fd:
+                    self.state=json.load(fd)
+            except (OSError,ValueError) as ex:
+                Logger.LOGGER.fatal("cannot resume; no valid checkpoint found: %s\n",ex)
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.',exist_ok=True)
+            with open(self.path+'.tmp','w') as fd:
+                json.dump(self.state,fd)
+            os.replace(self.path+'.tmp',self.path)
+        except OSError as ex:
+            Logger.LOGGER.warn("could not save checkpoint: %s\n",ex)
+
+    def remaining(self,jobs):
+        """skips the jobs already burned and cuts the burned rows from the interrupted one"""
+        done=self.state['jobs']
+        for i,data in enumerate(jobs):
+            if i<len(done):
+                if data.hash()!=done[i]:
+                    Logger.LOGGER.fatal("the job does not match the checkpoint; use the same options as for the interrupted burn\n")
+                if i<len(done)-1 or self.state['burned']>=len(data.rows):
+                    Logger.LOGGER.info("skipping job %d (already burned)\n",i+1)
+                    continue
+                Logger.LOGGER.info("resuming job %d at row %d of %d\n",i+1,self.state['burned'],len(data.rows))
+                data=data.remainder(self.state['burned'])
+            yield data
+
+    def start(self,data):
+        if not data.skipped:
+            self.state['jobs'].append(data.hash())
+        self.state.update(sent=data.skipped,percent=0,burned=data.skipped)
+        self._save()
+
+    def progress(self,data,sent,percent):
+        """sent: acknowledged rows; percent: progress reported by the engraver"""
+        # rows are burned top down; round down so that no row is missed
+        self.state.update(sent=data.skipped+sent,percent=percent,burned=data.skipped+len(data.rows)*percent//100)
+        self._save()
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def solve(a,b):
+    """solves the linear equations a*x=b by gaussian elimination with partial pivoting;
+    returns None if the system is singular"""
+    n=len(b)
+    m=[list(a[i])+[b[i]] for i in range(n)]
+    for c in range(n):
+        p=max(range(c,n),key=lambda r:abs(m[r][c]))
+        if abs(m[p][c])<1e-12:
+            return None
+        m[c],m[p]=m[p],m[c]
+        for r in range(c+1,n):
+            f=m[r][c]/m[c][c]
+            for k in range(c,n+1):
+                m[r][k]-=f*m[c][k]
+    x=[0.]*n
+    for r in reversed(range(n)):
+        x[r]=(m[r][n]-sum(m[r][k]*x[k] for k in range(r+1,n)))/m[r][r]
+    return x
+
+class BurnModel(object):
+    """predicts the transfer and burn time (secs) of a job from its row statistics;
+    the coefficients are fitted from the history of recorded jobs"""
+    MODEL=None
+    # features and default coefficients per job, row, byte (115200 baud)
+    TRANSFER=(lambda s:(1.,s['rows'],s['bytes']),(0.5,0.003,0.0000868))
+    # features and default coefficients per job, row, dark pixel and depth unit, dark pixel and power unit, burn run
+    BURN=(lambda s:(1.,s['rows'],s['dark']*s['depth'],s['dark']*s['power'],s['runs']),(2.,0.02,0.00002,0.,0.0005))
+    RIDGE=0.01 # weight pulling the fit towards the default coefficients
+
+    def __init__(self,history=None):
+        self.history=history
+        self.jobs=[]
+        if history and os.path.exists(history):
+            with open(history) as fd:
+                for line in fd:
+                    try:
+                        self.jobs.append(json.loads(line))
+                    except ValueError:
+                        Logger.LOGGER.warn("ignoring invalid line in %s\n",history)
+        self.transfer=self._fit(self.TRANSFER,'transfer')
+        self.burn=self._fit(self.BURN,'burn')
+
+    def _fit(self,model,key):
+        features,coeffs=model
+        if len(self.jobs)<len(coeffs):
+            return coeffs
+        n=len(coeffs)
+        a=[[0.]*n for i in range(n)]
+        b=[0.]*n
+        for job in self.jobs:
+            x=features(job)
+            for i in range(n):
+                b[i]+=x[i]*job[key]
+                for j in range(n):
+                    a[i][j]+=x[i]*x[j]
+        for i in range(n): # ridge regression towards the defaults
+            w=self.RIDGE*a[i][i]+1e-9
+            a[i][i]+=w
+            b[i]+=w*coeffs[i]
+        return solve(a,b) or coeffs
+
+    def estimate(self,stats):
+        """returns the estimated transfer and burn time"""
+        return tuple(max(0.,sum(c*x for c,x in zip(coeffs,features(stats))))
+                     for (features,_),coeffs in ((self.TRANSFER,self.transfer),(self.BURN,self.burn)))
+
+    def record(self,stats,transfer,burn):
+        """appends a completed job to the history and refits the model"""
+        job=dict(stats,transfer=round(transfer,2),burn=round(burn,2))
+        self.jobs.append(job)
+        if self.history:
+            try:
+                os.makedirs(os.path.dirname(self.history) or '.',exist_ok=True)
+                with open(self.history,'a') as fd:
+                    fd.write(json.dumps(job,sort_keys=True)+'\n')
+            except OSError as ex:
+                Logger.LOGGER.warn("could not record job: %s\n",ex)
+        self.transfer=self._fit(self.TRANSFER,'transfer')
+        self.burn=self._fit(self.BURN,'burn')
+
+    @classmethod
+    def set(cls,model):
+        cls.MODEL=model
+
+    @classmethod
+    def get(cls):
+        if cls.MODEL==None:
+            cls.MODEL=BurnModel()
+        return cls.MODEL
+
+def levelsRange(hist,cutoff):
+    """returns the gray levels between which the histogram lies when cutoff
+    percent of the pixels are ignored at either end (as ImageOps.autocontrast)"""
+    h=list(hist)
+    for order in (range(256),range(255,-1,-1)):
+        cut=int(sum(hist)*cutoff//100)
+        for v in order:
+            n=min(cut,h[v])
+            h[v]-=n
+            cut-=n
+            if cut<=0:
+                break
+    lo=next((v for v in range(256) if h[v]),255)
+    hi=next((v for v in range(255,-1,-1) if h[v]),0)
+    return (lo,hi)
+
+@functools.lru_cache(maxsize=64)
+def toneTable(contrast,brightness,gamma,lo,hi,mean):
+    """the lookup table for stretching lo..hi to the full range followed by
+    contrast (around mean), brightness and gamma; rounding follows ImageOps
+    and ImageEnhance"""
+    lut=[]
+    for v in range(256):
+        if hi>lo:
+            scale=255./(hi-lo)
+            v=max(0,min(255,int(v*scale-lo*scale)))
+        if contrast!=None:
+            v=max(0,min(255,int(mean+contrast*(v-mean))))
+        if brightness!=None:
+            v=max(0,min(255,int(brightness*v)))
+        if gamma!=None:
+            v=int(round(255.*(v/255.)**(1./gamma)))
+        lut.append(v)
+    return lut
+
+def estimateBurnTime(stats):
+    return sum(BurnModel.get().estimate(stats))
+
+def estimateJobs(jobs):
+    """returns the estimated transfer and burn time of all jobs"""
+    est=[BurnModel.get().estimate(data.stats()) for data in jobs]
+    return (sum(e[0] for e in est),sum(e[1] for e in est))
+
 def imageTrf(para):
+    from PIL import Image
     trf={'cw':Image.ROTATE_270,
      'ccw':Image.ROTATE_90,
      'turn':Image.ROTATE_180,
@@ -587,6 +1496,12 @@ def imageTrf(para):
         raise ValueError
     return (para,trf)
 
+def gammaValue(para):
+    para=float(para)
+    if para<=0.:
+        raise ValueError
+    return para
+
 def contrastBrightnessValue(para):
     para=max(-10.,min(10.,float(para)))
     if para<0.:
@@ -615,8 +1530,9 @@ if __name__ == '__main__':
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter,
                                      epilog='''All distances and sizes can be specified in steps or millimeter by just adding mm to a given number.
                                                The KKMoon engraver has a resolution of 500 steps/inch (19.685.. steps/mm)''')
-    parser.add_argument('-d', '--device',metavar="device",help='the serial device',default="/dev/ttyUSB0")
+    parser.add_argument('-d', '--device',metavar="device",help='the serial device; use replay:<file> to simulate the engraver of a trace recorded with --record',default="/dev/ttyUSB0")
     parser.add_argument('-s', '--speed',metavar="speed",help='the speed of the serial device',type=int,default=115200)
+    parser.add_argument('--record',metavar='file',help='record the serial traffic with timestamps to a trace file; see serialtrace.py',default=None)
     parser.add_argument('-v', '--verbosity',help='increase verbosity level ',action='count',default=0)
     parser.add_argument('--fan',help='switch fan on',dest='fan',action='store_true',default=None)
     parser.add_argument('--no-fan',help='switch fan off',dest='fan',action='store_false',default=None)
@@ -637,6 +1553,10 @@ if __name__ == '__main__':
                         type=contrastBrightnessValue,default=None)
     parser.add_argument('--brightness',metavar='number', help='adjust the brightness of the image (-10..10)',
                         type=contrastBrightnessValue,default=None)
+    parser.add_argument('--gamma',metavar='number', help='apply a gamma correction to the image; values above 1 lighten the midtones',
+                        type=gammaValue,default=None)
+    parser.add_argument('--auto-levels',metavar='percent', help='stretch the gray levels of the image to the full range; the given percentage of the darkest and lightest pixels is ignored',
+                        dest='levels',type=float,const=0.5,default=None,nargs='?')
     parser.add_argument('-t','--text',metavar='text', help='the text to engrave; you also have to specify a font with the --font option')
     parser.add_argument('--font',metavar='font', help='the truetype/opentype font used to engrave text')
     parser.add_argument('-T','--transform',metavar='cw|ccw|turn|tb|lr', help='''transform the image after any other operation just before engraving.
@@ -645,13 +1565,28 @@ if __name__ == '__main__':
                                                     turn - rotate 180 degrees ; tb - flip top-bottom ; lr - flip left-right ''',type=imageTrf,dest='trf',nargs='+')
     parser.add_argument('-S','--maxsize',help='scale the image down to match maximal width and height; the aspect ratio is kept',
                         metavar='w:h',dest='size',type=valuePair,default=None)    
+    parser.add_argument('--auto-orient', help='rotate the image to the orientation (none, cw, ccw or turn) with the lowest estimated engraving time; blank borders are trimmed',
+                        dest='orient',default=False,action='store_true')
     parser.add_argument('--invert', help='invert the image/text before engraving',default=False,action='store_true')
+    parser.add_argument('--layers',metavar='number', help='engrave a grayscale image in the given number of depth layers instead of dithering it; every layer is engraved with a depth proportional to its gray level up to the --depth value',
+                        type=int,default=None)
+    parser.add_argument('--nest',metavar='item', help='nest several images or texts (given as text:<text>) onto the bed and engrave them in one job; every item is scaled with --maxsize',
+                        nargs='+',default=None)
+    parser.add_argument('--gap',metavar='distance', help='the minimal distance between nested items',type=unitValue,default=20)
     parser.add_argument('--limit', help='set maximum no. of steps in x/y direction',metavar=('steps'),dest='lim',type=int,default=1575)
+    parser.add_argument('--tile', help='split images larger than the limit into tiles which are engraved one after another; the tiles overlap by the given amount',
+                        metavar=('overlap'),type=unitValue,const=0,default=None,nargs='?')
+    parser.add_argument('--resume', help='resume the interrupted burn saved in the checkpoint file; the options must be the same as for the interrupted burn',
+                        default=False,action='store_true')
+    parser.add_argument('--checkpoint',metavar='file', help='the file for saving the progress of a burn',default=CHECKPOINT)
+    parser.add_argument('--history',metavar='file', help='the file for recording the times of engraving jobs; it is used to calibrate the estimation of the engraving time',
+                        default=HISTORY)
     parser.add_argument('--dry-run', help='do not engrave anything; you can specify an optional file for saving engraving data'
                         ,metavar=('imagefile'),dest='dummy',const=".",default=None,nargs='?')
     
     args = parser.parse_args()
     Logger.set(Logger(args.verbosity))
+    BurnModel.set(BurnModel(args.history))
     engraver=Engraver(args)
     if not args.dummy:
         engraver.open()
@@ -670,6 +1605,8 @@ if __name__ == '__main__':
         engraver.frame(*args.frame,args.centerref,args.center)
     elif args.checker:
         data=EngraverData.checkerboard(args)
+    elif args.nest:
+        data=EngraverData.fromItems(args)
     elif args.image:
         data=EngraverData.fromImage(args)
     elif args.text:
@@ -677,11 +1614,15 @@ if __name__ == '__main__':
             data=EngraverData.fromText(args)
         else:
             Logger.LOGGER.error("no font is given; please use --font to specify a truetype/opentype font\n\n")
+    if args.dummy and data:
+        transfer,burn=estimateJobs([data] if isinstance(data,EngraverData) else list(data))
+        Logger.LOGGER.info("estimated time: transfer %s, engraving %s, total %s\n",
+                           formatTime(transfer),formatTime(burn),formatTime(transfer+burn))
     if not args.dummy:
         if data:
             if args.fan==None: # switch on while engraving
                 engraver.fan(True)
-            engraver.burn(data,args.centerref)
+            engraver.burn(data,args.centerref,Checkpoint(args.checkpoint,args.resume))
         engraver.close()
     if not (args.home or args.move or args.frame or data or args.verbosity or args.fan!=None or args.dummy):
         parser.print_help()
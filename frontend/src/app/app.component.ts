@@ -34,6 +34,10 @@ export class AppComponent implements OnInit, AfterViewInit {
     contrast: number=0;
     
     brightness: number=0;
+
+    gamma: number=1;
+
+    autoLevels: boolean=false;
     
     mode: string = "image";
 
@@ -55,6 +59,8 @@ export class AppComponent implements OnInit, AfterViewInit {
 
     brightnessUpdate = new Subject<string>();
 
+    gammaUpdate = new Subject<string>();
+
     private rotationArray = ["", "ccw", "turn", "cw"];
 
     private rotation = 0;
@@ -94,6 +100,7 @@ export class AppComponent implements OnInit, AfterViewInit {
         this.textUpdate.pipe(debounceTime(this.debounceTime), distinctUntilChanged()).subscribe(e => this.updateImage());
         this.contrastUpdate.pipe(debounceTime(this.debounceTime), distinctUntilChanged()).subscribe(e => this.updateImage());
         this.brightnessUpdate.pipe(debounceTime(this.debounceTime), distinctUntilChanged()).subscribe(e => this.updateImage());
+        this.gammaUpdate.pipe(debounceTime(this.debounceTime), distinctUntilChanged()).subscribe(e => this.updateImage());
         this.scrollContainer = <HTMLDivElement> this.scrollFrame.nativeElement;
         this.updateImage();
         this.connect();
@@ -119,7 +126,8 @@ export class AppComponent implements OnInit, AfterViewInit {
         this.service.receive(
             (obj) => this.messageHandler(obj),
             (obj) => this.statusHandler(obj),
-            (obj) => this.commandHandler(obj));
+            (obj) => this.commandHandler(obj),
+            (frame) => this.imageDisplay.displayFrame(frame));
         this.retrieveStatus();
         this.service.fonts().then(flist => this.updateFontList(flist));
 
@@ -139,6 +147,15 @@ export class AppComponent implements OnInit, AfterViewInit {
         }
     }
 
+    remainingTime(): string {
+        let estimate = this.status.estimate;
+        if (!estimate) {
+            return '';
+        }
+        let secs = Math.max(0, Math.round(estimate.remaining));
+        return ' (about ' + Math.floor(secs / 60) + ':' + ('0' + secs % 60).slice(-2) + ' min left)';
+    }
+
     messageHandler(msg: Message) {
         let match = this.progressPat.exec(msg.content);
         if (match) {
@@ -170,15 +187,17 @@ export class AppComponent implements OnInit, AfterViewInit {
     }
 
     updateImage() {
-        var src;
+        var args;
         if (this.mode == 'image') {
-            src = `/image?width=${this.width}&height=${this.height}&trf=${this.transformation()}&contrast=${this.contrast}&brightness=${this.brightness}`;
+            args = {'mode': 'image', 'width': this.width, 'height': this.height, 'trf': this.transformation(), 'contrast': this.contrast, 'brightness': this.brightness,
+                    'gamma': this.gamma, 'autolevels': this.autoLevels ? 1 : 0};
         } else {
-            let txt = encodeURIComponent(this.text);
-            src = `/textimage?text=${txt}&width=${this.width}&height=${this.height}&font=${this.selectedFont}&trf=${this.transformation()}`;
+            args = {'mode': 'text', 'text': this.text, 'width': this.width, 'height': this.height, 'font': this.selectedFont, 'trf': this.transformation()};
         }
-        console.log("src=" + src)
-        this.imageDisplay.loadImage(src);
+        [args['viewWidth'], args['viewHeight']] = this.imageDisplay.viewSize();
+        args['seq'] = this.imageDisplay.nextFrame();
+        args['deflate'] = this.imageDisplay.canInflate();
+        this.service.send({'cmd': 'preview', 'args': args});
     }
 
     fontChanged() {
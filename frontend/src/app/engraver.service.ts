@@ -9,18 +9,24 @@ import {Message, Status, Generic, Command,Font} from '.';
 })
 export class EngraverService {
 
-    private socket: WebSocketSubject<Generic|Command> = webSocket(`ws://${location.hostname}:${location.port}/ws`);
+    private socket: WebSocketSubject<Generic|Command|ArrayBuffer> = webSocket({
+        url: `ws://${location.hostname}:${location.port}/ws`,
+        binaryType: 'arraybuffer',
+        deserializer: (e: MessageEvent) => e.data instanceof ArrayBuffer ? e.data : JSON.parse(e.data)
+    });
     
     constructor(public http: HttpClient) {
         
     }
     
-    receive(msgFunc:(msg:Message)=>void,statusFunc:(msg:Status)=>void,cmdFunc:(cmd:Command)=>void) {
+    receive(msgFunc:(msg:Message)=>void,statusFunc:(msg:Status)=>void,cmdFunc:(cmd:Command)=>void,frameFunc:(frame:ArrayBuffer)=>void) {
         this.socket.pipe(
             retryWhen(error => error.pipe(tap(e => console.log("retry:" + JSON.stringify(e)))))
         ).subscribe( 
             (obj) => {
-                if ((<Generic>obj).type==='message') {
+                if (obj instanceof ArrayBuffer) {
+                    frameFunc(obj);
+                } else if ((<Generic>obj).type==='message') {
                     msgFunc(Object.assign(new Message(),<Message>obj));
                 } else if ((<Generic>obj).type==='status') {
                     statusFunc(Object.assign(new Status(),<Status>obj));                    
@@ -34,6 +34,18 @@ export class ImageDisplayComponent implements OnInit, AfterViewInit {
 
     private _center = false;
 
+    private frameCanvas: HTMLCanvasElement = null;
+
+    private frameBits: Uint8Array = null;
+
+    private frameSeq = 0;
+
+    private frameSize = [0, 0];
+
+    private useFrame = false;
+
+    private frameQueue: Promise<void> = Promise.resolve();
+
     outerHeight = 500;
 
     constructor() {}
@@ -123,7 +135,7 @@ export class ImageDisplayComponent implements OnInit, AfterViewInit {
         ctx.fillStyle = "#ffffff";
         ctx.lineWidth = 3;
 
-        let img = <HTMLImageElement> this.image.nativeElement;
+        let img = this.source();
         ctx.clearRect(0, 0, overlay.width + this.margin, overlay.height + this.margin);
         if (progress != null) {
             let start = img.height * progress + this.margin;
@@ -140,8 +152,15 @@ export class ImageDisplayComponent implements OnInit, AfterViewInit {
 
     }
 
+    private source(): HTMLImageElement | HTMLCanvasElement {
+        if (this.useFrame) {
+            return this.frameCanvas;
+        }
+        return <HTMLImageElement> this.image.nativeElement;
+    }
+
     displayImage() {
-        let img = <HTMLImageElement> this.image.nativeElement;
+        let img = this.source();
         let canvas = <HTMLCanvasElement> this.canvas.nativeElement;
         let overlay = <HTMLCanvasElement> this.overlay.nativeElement;
         canvas.width = window.innerWidth * this.widthFactor;
@@ -150,24 +169,27 @@ export class ImageDisplayComponent implements OnInit, AfterViewInit {
         overlay.height = canvas.height;
         this.outerHeight = overlay.height;
 
-        this.imageWidth = img.width;
-        this.imageHeight = img.height;
+        // a proxy frame is drawn at the size of the engraving it stands for
+        let width = this.useFrame ? this.frameSize[0] : img.width;
+        let height = this.useFrame ? this.frameSize[1] : img.height;
+        this.imageWidth = width;
+        this.imageHeight = height;
         
         var ctx = canvas.getContext('2d');
         var f = 1;
-        while ((img.width / f + this.margin) > canvas.width || (img.height / f + this.margin) > canvas.height) {
+        while ((width / f + this.margin) > canvas.width || (height / f + this.margin) > canvas.height) {
             f += 1;
         }
         f = 1. / f
 
         ctx.clearRect(0, 0, canvas.width + this.margin, canvas.height + this.margin);
-        this.drawRulers(img.width, img.height, ctx, f);
-        ctx.drawImage(img, 0, 0, img.width, img.height, this.margin, this.margin, f * img.width, f * img.height);
+        this.drawRulers(width, height, ctx, f);
+        ctx.drawImage(img, 0, 0, img.width, img.height, this.margin, this.margin, f * width, f * height);
         var offX = this.margin;
         var offY = this.margin;
         if (this.center) {
-            offX += f * img.width / 2.
-            offY += f * img.height / 2.
+            offX += f * width / 2.
+            offY += f * height / 2.
         }
         ctx.globalAlpha = 0.8;
         ctx.strokeStyle = "#0000ff";
@@ -180,13 +202,91 @@ export class ImageDisplayComponent implements OnInit, AfterViewInit {
         ctx.stroke();
 
         ctx.font = "12px Helvetica";
-        ctx.fillText(img.height.toFixed(), f * img.width + this.margin + 8, f * (img.height + this.margin) / 2. + 8);
-        ctx.fillText(img.width.toFixed(), f * (img.width + this.margin) / 2, f * img.height + this.margin + 16);
+        ctx.fillText(height.toFixed(), f * width + this.margin + 8, f * (height + this.margin) / 2. + 8);
+        ctx.fillText(width.toFixed(), f * (width + this.margin) / 2, f * height + this.margin + 16);
 
     }
 
     loadImage(src: string) {
+        this.useFrame = false;
         (<HTMLImageElement> this.image.nativeElement).src = src;
     }
 
+    /*
+     * size of the area available for the preview; the server renders a proxy
+     * fitting into it instead of the full resolution
+     */
+    viewSize(): number[] {
+        return [Math.max(1, Math.floor(window.innerWidth * this.widthFactor) - this.margin),
+                Math.max(1, window.innerHeight - this.reserved - this.margin)];
+    }
+
+    nextFrame(): number {
+        return ++this.frameSeq;
+    }
+
+    canInflate(): boolean {
+        return 'DecompressionStream' in window;
+    }
+
+    private inflate(data: Uint8Array): Promise<Uint8Array> {
+        let stream = (<any> new Blob([data])).stream().pipeThrough(new (<any> window).DecompressionStream('deflate'));
+        return new Response(stream).arrayBuffer().then(buf => new Uint8Array(buf));
+    }
+
+    /*
+     * binary preview frame: kind(1) flags(1) width(2) height(2) seq(4) followed
+     * by the packed 1-bit rows; flag 1: XOR delta to the previous frame, flag 2: deflated,
+     * flag 4: downscaled proxy, the header is followed by the full width(2) and height(2)
+     */
+    displayFrame(frame: ArrayBuffer) {
+        let view = new DataView(frame);
+        let flags = view.getUint8(1);
+        let width = view.getUint16(2);
+        let height = view.getUint16(4);
+        let seq = view.getUint32(6);
+        let offset = 10;
+        let full = [width, height];
+        if (flags & 4) {
+            full = [view.getUint16(10), view.getUint16(12)];
+            offset += 4;
+        }
+        let payload = new Uint8Array(frame, offset);
+        let data = (flags & 2) ? this.inflate(payload) : Promise.resolve(payload);
+        // deltas refer to the previous frame, so frames are applied in order of arrival
+        this.frameQueue = this.frameQueue.then(() => data).then(bits => {
+            if (flags & 1) {
+                let prev = this.frameBits;
+                for (var i = 0; i < bits.length; i++) {
+                    bits[i] ^= prev[i];
+                }
+            }
+            this.frameBits = bits;
+            if (seq == this.frameSeq) {
+                this.frameSize = full;
+                this.drawFrame(bits, width, height);
+            }
+        });
+    }
+
+    private drawFrame(bits: Uint8Array, width: number, height: number) {
+        if (!this.frameCanvas) {
+            this.frameCanvas = document.createElement('canvas');
+        }
+        this.frameCanvas.width = width;
+        this.frameCanvas.height = height;
+        let ctx = this.frameCanvas.getContext('2d');
+        let image = ctx.createImageData(width, height);
+        let pixels = new Uint32Array(image.data.buffer);
+        let rowBytes = (width + 7) >> 3;
+        for (var y = 0; y < height; y++) {
+            for (var x = 0; x < width; x++) {
+                pixels[y * width + x] = (bits[y * rowBytes + (x >> 3)] & (0x80 >> (x & 7))) ? 0xffffffff : 0xff000000;
+            }
+        }
+        ctx.putImageData(image, 0, 0);
+        this.useFrame = true;
+        this.displayImage();
+    }
+
 }
@@ -10,7 +10,8 @@ export class Status extends Generic{
         public framing = false,
         public engraving = false,
         public useCenter=false,
-        public centerAxis:string=undefined) {
+        public centerAxis:string=undefined,
+        public estimate:{transfer:number,burn:number,remaining:number}=null) {
         super('status');
     }
 }
@@ -24,25 +24,43 @@ import struct
 import traceback
 import codecs
 import threading
-import queue
+import heapq
 import argparse
-import cgi
-import webbrowser
 import socket
 import time
 import re
-import ctypes
+import gzip
+import tempfile
+import zlib
+import secrets
+import itertools
+import functools
+
+try:
+    import brotli
+except ImportError:
+    brotli=None
 
 from select import select
 from http.server import SimpleHTTPRequestHandler,HTTPServer
-from PIL import Image,ImageDraw,ImageFont
+from PIL import Image
 from urllib.parse import parse_qs
 from io import BytesIO
+from collections import OrderedDict,namedtuple
+from http.cookies import SimpleCookie
+from concurrent.futures import ThreadPoolExecutor
 
-from engraver import Logger,Engraver,EngraverData,DESCRIPTION,VERSION,unitValue,imageTrf,UI,contrastBrightnessValue
+from engraver import Metrics,Logger,Engraver,EngraverData,DESCRIPTION,VERSION,unitValue,imageTrf,UI,contrastBrightnessValue,BurnModel,HISTORY,estimateJobs
 
 ##############################################################################
 FONTDIR='fonts'
+WEBDIR='web'
+FRAME_ZLEVEL=3
+MAXUPLOAD=64<<20
+REQUEST_TIMEOUT=10
+KEEPALIVE_TIMEOUT=15
+MAXCONNECTIONS=32
+SPOOLSIZE=8<<20
 
 STREAM = 0x0
 TEXT = 0x1
@@ -58,23 +76,408 @@ LENGTHLONG = 5
 MASK = 6
 PAYLOAD = 7
 
+DEFLATE_TAIL = b'\x00\x00\xff\xff'
+DEFLATE_LEVEL = 6
+
 STATUS_CODES = [1000, 1001, 1002, 1003, 1007, 1008, 1009, 1010, 1011, 3000, 3999, 4000, 4999]
 
-# key value store
-STORAGE={}
+DECODER=ThreadPoolExecutor(1)
+
+SESSION_COOKIE='kksession'
+MAXSESSIONS=32
+
+def CacheLookup(cache,hit):
+    Metrics.get().inc('kkengraver_cache_requests_total',cache=cache,result='hit' if hit else 'miss')
 
-def StoreImage(fd):
-    global args
+def DecodeImage(fd,previous=None):
+    """opens the image (which only reads its header) and decodes it in the background;
+    returns a future of the decoded image"""
     img=Image.open(fd)
-    img.load()
-    img=EngraverData.preprocessImage(img,args)
-    STORAGE['image']=img
-    
+
+    def decode():
+        try:
+            img.load()
+            return EngraverData.preprocessImage(img,args)
+        except Exception as ex:
+            Logger.LOGGER.error("cannot decode image: %s\n",ex)
+            return previous.result() if previous else None
+        finally:
+            if hasattr(fd,'close'):
+                fd.close()
+
+    return DECODER.submit(decode)
+
+
+class Session(object):
+    """the workspace of one browser: its uploaded image and its rendered text.
+    Every attribute is replaced as a whole, so a render never sees half an update"""
+    IMAGEIDS=itertools.count(1)
+    LOGO=None
+
+    def __init__(self,sid):
+        self.id=sid
+        self.image=Session.LOGO
+        self.imageid=0
+        self.scaled=None
+        self.text=None
+        # the text and tone adjustments of the last preview are used for engraving
+        self.textArgs=None
+        self.tone={}
+        self.websockets=set() # a session with open websockets is never evicted
+
+    def store(self,fd):
+        self.image=DecodeImage(fd,self.image)
+        self.imageid=next(Session.IMAGEIDS)
+
+    def loadedImage(self):
+        """returns the last stored image; waits for it to be decoded"""
+        return self.image.result()
+
+    def scaledImage(self,size):
+        """returns the loaded image scaled down to size; the last one is cached"""
+        key=(self.imageid,size)
+        cached=self.scaled
+        CacheLookup('scaled',cached and cached[0]==key)
+        if not cached or cached[0]!=key:
+            with Metrics.get().timer('kkengraver_render_seconds',stage='scale'):
+                img=self.loadedImage().copy()
+                img.thumbnail(size)
+            cached=(key,img)
+            self.scaled=cached
+        return cached[1].copy()
+
+    def textImage(self,args):
+        """returns the image of the text; the last one is cached"""
+        key=(args.text,args.size,args.font)
+        cached=self.text
+        CacheLookup('text',cached and cached[0]==key)
+        if not cached or cached[0]!=key:
+            with Metrics.get().timer('kkengraver_render_seconds',stage='text'):
+                cached=(key,EngraverData.imageFromText(args))
+            self.text=cached
+        return cached[1]
+
+    def lastText(self):
+        """returns the image of the text of the last text preview"""
+        return self.textImage(self.textArgs) if self.textArgs else None
+
+
+class Sessions(object):
+    """the sessions of the last few browsers keyed by the session cookie;
+    only the thread of the server loop creates sessions"""
+
+    def __init__(self,size=MAXSESSIONS):
+        self.size=size
+        self.entries=OrderedDict()
+
+    def get(self,sid):
+        """returns the session with the given id; a new one is started for an unknown id"""
+        session=self.entries.get(sid)
+        if session:
+            self.entries.move_to_end(sid)
+            return session
+        session=Session(secrets.token_hex(16))
+        self.entries[session.id]=session
+        excess=len(self.entries)-self.size
+        for sid in list(self.entries)[:-1]: # not the new one
+            if excess<=0:
+                break
+            if not self.entries[sid].websockets:
+                del self.entries[sid]
+                excess-=1
+        return session
+
+SESSIONS=Sessions()
+
+
+def RequestArgs(**kw):
+    """returns the command line options updated with the values of one request;
+    the result is immutable, so concurrent requests cannot affect each other"""
+    opts=dict(vars(args),**kw)
+    return _requestArgsType(tuple(sorted(opts)))(**opts)
+
+@functools.lru_cache()
+def _requestArgsType(fields):
+    return namedtuple('RequestArgs',fields)
+
+
+class MultipartReader(object):
+    """reads a multipart/form-data body in chunks and writes the content of
+    a single part to a spooled temporary file"""
+
+    CHUNK=65536
+    MAXHEADER=16384
+
+    def __init__(self,rfile,boundary,length):
+        self.rfile=rfile
+        self.delim=b'\r\n--'+bytes(boundary,'latin-1')
+        self.remaining=length
+
+    def _fill(self,buf):
+        if self.remaining<=0:
+            raise ValueError("unexpected end of multipart data")
+        chunk=self.rfile.read(min(self.CHUNK,self.remaining))
+        if not chunk:
+            raise ValueError("unexpected end of multipart data")
+        self.remaining-=len(chunk)
+        buf+=chunk
+
+    def _skip(self):
+        while self.remaining>0:
+            self.remaining-=len(self.rfile.read(min(self.CHUNK,self.remaining)))
+
+    def read(self,name):
+        result=None
+        buf=bytearray(b'\r\n')
+        dlen=len(self.delim)
+        # preamble
+        while True:
+            idx=buf.find(self.delim)
+            if idx>=0:
+                del buf[:idx+dlen]
+                break
+            del buf[:-dlen]
+            self._fill(buf)
+        while True:
+            while len(buf)<2:
+                self._fill(buf)
+            if buf[:2]==b'--':
+                self._skip()
+                return result
+            # part headers
+            while True:
+                idx=buf.find(b'\r\n\r\n')
+                if idx>=0:
+                    break
+                if len(buf)>self.MAXHEADER:
+                    raise ValueError("multipart header too large")
+                self._fill(buf)
+            headers=bytes(buf[2:idx]).decode('utf-8','replace')
+            del buf[:idx+4]
+            m=re.search(r'(?im)^content-disposition:.*;\s*name="([^"]*)"',headers)
+            out=None
+            if m and m.group(1)==name and result==None:
+                out=result=tempfile.SpooledTemporaryFile(max_size=SPOOLSIZE)
+            # part body
+            while True:
+                idx=buf.find(self.delim)
+                if idx>=0:
+                    if out:
+                        out.write(buf[:idx])
+                    del buf[:idx+dlen]
+                    break
+                keep=len(buf)-dlen
+                if keep>0:
+                    if out:
+                        out.write(buf[:keep])
+                    del buf[:keep]
+                self._fill(buf)
+            if out:
+                out.seek(0)
+
+
+class FontIndex(threading.Thread):
+    """keeps an index of the fonts below FONTDIR; font files are only opened
+    if they are new or their mtime/size changed since the last scan"""
+
+    EXP=re.compile(r"\.(ttf|otf|pfb)$",re.I)
+    INDEXFILE='.fontindex.json'
+    WAIT=0.5 # max. secs the server loop waits for the first scan
+
+    def __init__(self,fontdir):
+        threading.Thread.__init__(self)
+        self.daemon=True
+        self.fontdir=fontdir
+        self.indexfile=os.path.join(fontdir,self.INDEXFILE)
+        self.entries={}
+        self.trigger=threading.Event()
+        self.ready=threading.Event()
+        self.publish()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.indexfile,'r') as fd:
+                # fonts that could not be loaded are opened again
+                self.entries={f:e for f,e in json.load(fd).items() if e.get('name')}
+            self.publish()
+            self.ready.set()
+        except (OSError,ValueError):
+            self.entries={}
+
+    def save(self):
+        tmp=self.indexfile+'.tmp'
+        try:
+            with open(tmp,'w') as fd:
+                json.dump({f:e for f,e in self.entries.items() if e.get('name')},fd)
+            os.replace(tmp,self.indexfile)
+        except OSError as ex:
+            Logger.LOGGER.warn("cannot write font index '%s': %s\n",self.indexfile,ex)
+
+    def publish(self,entries=None):
+        entries=self.entries if entries==None else entries
+        flist=[{'name':e['name'],'file':f} for f,e in sorted(entries.items()) if e.get('name')]
+        body=json.dumps(flist)
+        self._snapshot=('"%s"'%hashlib.sha1(bytes(body,'utf-8')).hexdigest(),body)
+
+    def scan(self):
+        from PIL import ImageFont
+        found={}
+        for root,dirs,files in os.walk(self.fontdir):
+            dirs.sort()
+            for f in files:
+                if self.EXP.search(f):
+                    path=os.path.join(root,f)
+                    try:
+                        st=os.stat(path)
+                    except OSError:
+                        continue
+                    found[os.path.relpath(path,self.fontdir).replace(os.sep,'/')]=(st.st_mtime,st.st_size)
+        changed=found.keys()!=self.entries.keys()
+        entries={}
+        published=time.monotonic()
+        for f,(mtime,size) in found.items():
+            e=self.entries.get(f)
+            if not e or e['mtime']!=mtime or e['size']!=size:
+                e={'mtime':mtime,'size':size,'name':None}
+                try:
+                    fname=ImageFont.truetype(os.path.join(self.fontdir,f)).getname()
+                    e['name']="%s (%s)"%(fname[0],fname[1])
+                except (OSError,ValueError):
+                    Logger.LOGGER.error("cannot load font from file '%s'\n",f)
+                changed=True
+            entries[f]=e
+            if not self.ready.is_set() and time.monotonic()-published>0.1:
+                self.publish(entries)
+                published=time.monotonic()
+        if changed:
+            self.entries=entries
+            self.publish()
+            self.save()
+        self.ready.set()
+
+    def snapshot(self):
+        """returns the current (etag,body); while the first scan is running
+        this may be the fonts found so far"""
+        self.ready.wait(self.WAIT)
+        return self._snapshot
+
+    def update(self):
+        self.trigger.set()
+
+    def run(self):
+        while True:
+            self.scan()
+            self.trigger.wait()
+            self.trigger.clear()
+
+
+class StaticFiles(object):
+    """in-memory cache of the files below WEBDIR together with their
+    compressed variants; precompressed files (*.gz, *.br) are preferred"""
+
+    HASHED=re.compile(r"[.-][0-9a-f]{16,}\.[a-z0-9]+$")
+    COMPRESS=re.compile(r"^(text/|application/(javascript|json|xml)|image/svg|font/ttf|application/x-font-ttf)")
+
+    def __init__(self,root,maxsize=32<<20):
+        self.root=os.path.abspath(root)
+        self.maxsize=maxsize
+        self.total=0
+        self.files=OrderedDict()
+
+    def _variant(self,data,enc):
+        return (data,'"%s%s"'%(hashlib.sha1(data).hexdigest()[:20],enc and '-'+enc or ''))
+
+    def _precompressed(self,path,ext,mtime):
+        try:
+            if os.stat(path+ext).st_mtime>=mtime:
+                with open(path+ext,'rb') as fd:
+                    return fd.read()
+        except OSError:
+            pass
+        return None
+
+    def load(self,path,st,ctype):
+        with open(path,'rb') as fd:
+            data=fd.read()
+        variants={'identity':self._variant(data,None)}
+        if self.COMPRESS.match(ctype) and len(data)>256:
+            gz=self._precompressed(path,'.gz',st.st_mtime) or gzip.compress(data,9)
+            if len(gz)<len(data):
+                variants['gzip']=self._variant(gz,'gz')
+            br=self._precompressed(path,'.br',st.st_mtime)
+            if br==None and brotli:
+                br=brotli.compress(data)
+            if br and len(br)<len(data):
+                variants['br']=self._variant(br,'br')
+        immutable=self.HASHED.search(path)!=None
+        return {'mtime':st.st_mtime,'size':st.st_size,'ctype':ctype,'variants':variants,
+                'cache':immutable and "public, max-age=31536000, immutable" or "no-cache",
+                'bytes':sum(len(v[0]) for v in variants.values())}
+
+    def get(self,path,ctype):
+        try:
+            st=os.stat(path)
+        except OSError:
+            return None
+        e=self.files.get(path)
+        if e and e['mtime']==st.st_mtime and e['size']==st.st_size:
+            self.files.move_to_end(path)
+            CacheLookup('static',True)
+            return e
+        CacheLookup('static',False)
+        if e:
+            self.total-=self.files.pop(path)['bytes']
+        e=self.load(path,st,ctype)
+        self.files[path]=e
+        self.total+=e['bytes']
+        while self.total>self.maxsize and len(self.files)>1:
+            self.total-=self.files.popitem(last=False)[1]['bytes']
+        return e
+
+    @staticmethod
+    def encoding(e,accept):
+        accepted=set()
+        for a in (accept or '').split(','):
+            a=a.split(';')
+            if len(a)>1 and re.match(r"\s*q=0(\.0*)?\s*$",a[1]):
+                continue
+            accepted.add(a[0].strip().lower())
+        for enc in ('br','gzip'):
+            if enc in e['variants'] and enc in accepted:
+                return enc
+        return 'identity'
+
+
+def NegotiateDeflate(offers):
+    """returns the parameters of the first permessage-deflate offer (RFC 7692)
+    in the Sec-WebSocket-Extensions header that can be accepted or None"""
+    for offer in (offers or '').split(','):
+        parts=[p.strip() for p in offer.split(';')]
+        if parts[0]!='permessage-deflate':
+            continue
+        params={}
+        for p in parts[1:]:
+            k,_,v=p.partition('=')
+            params[k.strip()]=v.strip().strip('"')
+        if set(params)-{'server_no_context_takeover','client_no_context_takeover','server_max_window_bits','client_max_window_bits'}:
+            continue
+        bits=params.get('server_max_window_bits')
+        if bits!=None and not (bits.isdigit() and 9<=int(bits)<=15): # zlib cannot use a window of 8 bits
+            continue
+        params.pop('client_max_window_bits',None) # any client window can be inflated
+        return params
+    return None
+
+def DeflateExtension(params):
+    return '; '.join(['permessage-deflate']+[k if v=='' else '%s=%s'%(k,v) for k,v in params.items()])
+
 
 class Websocket(object):
-    def __init__(self,socket,registry):
+    def __init__(self,socket,registry,session=None,deflate=None):
         self.socket=socket
         self.registry=registry
+        self.session=session
         self.fileno=lambda s=self: s.socket
         self.fin = 0
         self.data = bytearray()
@@ -93,11 +496,23 @@ class Websocket(object):
         self.frag_decoder = codecs.getincrementaldecoder('utf-8')(errors='strict')
         self.closed = False
         self.lastupdate=0;
+        self.lastFrame=None
         self.state = HEADERB1
 
+        # permessage-deflate; the context is kept between messages unless the client objects
+        self.deflate=deflate
+        self.deflater=None
+        self.inflater=None
+        self.compressed=False
+        if deflate!=None:
+            self.deflater=self.NewDeflater()
+            self.inflater=zlib.decompressobj(-15)
+
         # restrict the size of header and payload for security reasons
         self.maxheader = 65536
         self.maxpayload = 33554432
+        if session:
+            session.websockets.add(self)
         self.registry.Register(self)
     
     def DoRead(self):
@@ -110,11 +525,24 @@ class Websocket(object):
                  
     def DoClose(self):
         print ('websocket closed',self.fileno())
+        if self.session:
+            self.session.websockets.discard(self)
         self.socket.close()
         self.registry.Unregister(self)
 
         
-    def DoWrite(self,data):
+    def NewDeflater(self):
+        bits=int(self.deflate.get('server_max_window_bits') or 15)
+        return zlib.compressobj(DEFLATE_LEVEL,zlib.DEFLATED,-bits)
+
+    def Deflate(self,data):
+        res=self.deflater.compress(data)+self.deflater.flush(zlib.Z_SYNC_FLUSH)
+        if 'server_no_context_takeover' in self.deflate:
+            self.deflater=self.NewDeflater()
+        return res[:-4] if res.endswith(DEFLATE_TAIL) else res
+
+    def DoWrite(self,data,compress=True):
+        """sends a message; it must be called with the lock of the registry held"""
         if isinstance(data, str):
             opcode = TEXT
             data = data.encode('utf-8')
@@ -123,6 +551,11 @@ class Websocket(object):
         payload = bytearray()
 
         b1 = 0x80|opcode
+        raw = len(data)
+        if self.deflater and compress:
+            data = self.Deflate(data)
+            b1 |= 0x40
+        self.registry.Traffic(raw,len(data))
 
         length = len(data)
         payload.append(b1)
@@ -143,10 +576,32 @@ class Websocket(object):
 
         if length > 0:
            payload.extend(data)
-        self.socket.send(payload)
-
+        self.socket.sendall(payload)
+
+
+    def HandleCompressed(self):
+        """collects the frames of a compressed message and inflates it as a whole"""
+        if self.opcode != STREAM:
+            self.frag_type = self.opcode
+            self.frag_buffer = bytearray()
+        self.frag_buffer.extend(self.data)
+        if self.fin:
+            data = self.inflater.decompress(bytes(self.frag_buffer)+DEFLATE_TAIL,self.maxpayload)
+            if self.inflater.unconsumed_tail:
+                raise Exception('payload exceeded allowable size')
+            if 'client_no_context_takeover' in self.deflate:
+                self.inflater = zlib.decompressobj(-15)
+            self.frag_buffer = None
+            self.compressed = False
+            if self.frag_type == TEXT:
+                data = data.decode('utf8', errors='strict')
+            self.registry.Receive(data,self)
 
     def HandlePacket(self):
+      if self.compressed and self.opcode in (TEXT, BINARY, STREAM):
+         self.HandleCompressed()
+         return
+
       if self.opcode == CLOSE:
          status = 1000
          reason = u''
@@ -213,7 +668,7 @@ class Websocket(object):
                   self.frag_buffer.extend(self.data)
                   self.data = self.frag_buffer
 
-              self.registry.Receive(self.data)
+              self.registry.Receive(self.data,self)
 
               self.frag_decoder.reset()
               self.frag_type = BINARY
@@ -236,7 +691,7 @@ class Websocket(object):
                   except Exception as exp:
                       raise Exception('invalid utf-8 payload')
                   
-              self.registry.Receive(self.data)
+              self.registry.Receive(self.data,self)
 
 
     def DecodeMessage(self, byte):
@@ -251,7 +706,9 @@ class Websocket(object):
          self.data = bytearray()
 
          rsv = byte & 0x70
-         if rsv != 0:
+         if rsv == 0x40 and self.inflater and self.opcode in (TEXT, BINARY):
+            self.compressed = True
+         elif rsv != 0:
             raise Exception('RSV bit must be 0')
 
       elif self.state == HEADERB2:
@@ -403,20 +860,209 @@ def parseTrf(trf):
         trf=[imageTrf(i) for i in trf.split(' ')]
     return trf
 
-        
+
+PNG_LEVEL=1
+
+def EncodePNG(img):
+    """encodes a preview; 1-bit previews compress well enough with a fast zlib level"""
+    fd=BytesIO()
+    with Metrics.get().timer('kkengraver_render_seconds',stage='png'):
+        img.save(fd,"png",compress_level=PNG_LEVEL)
+    return fd
+
+
+class PNGCache(object):
+    """keeps the last few encoded previews keyed by their render parameters"""
+
+    def __init__(self,size=16):
+        self.size=size
+        self.entries=OrderedDict()
+
+    def get(self,key):
+        fd=self.entries.get(key)
+        if fd:
+            self.entries.move_to_end(key)
+        return fd
+
+    def put(self,key,fd):
+        self.entries[key]=fd
+        while len(self.entries)>self.size:
+            self.entries.popitem(last=False)
+
+PNGCACHE=PNGCache()
+
+
+TEXT_PARAMS=['text','font','width','height']
+IMAGE_PARAMS=['width','height']
+
+def _getEnhanceValue(params,key):
+    res=None
+    val=params.get(key)
+    if val and abs(float(val))>0.001:
+        res=contrastBrightnessValue(val)
+    return res
+
+def _getGammaValue(params):
+    try:
+        val=float(params.get('gamma') or 1.)
+    except ValueError:
+        return None
+    return val if val>0. and abs(val-1.)>0.001 else None
+
+def TextArgs(params):
+    return RequestArgs(text=params['text'],
+                       size=(unitValue(params['width']),unitValue(params['height'])),
+                       font="%s/%s"%(FONTDIR,params['font']),
+                       trf=parseTrf(params.get('trf')))
+
+def SelectText(session,params):
+    """remembers the text of a preview for engraving; returns its arguments"""
+    session.textArgs=TextArgs(params)
+    return session.textArgs
+
+def RenderTextPreview(session,params):
+    targs=SelectText(session,params)
+    return EngraverData._trfImage(session.textImage(targs).copy(),targs)
+
+TONE_ARGS=('contrast','brightness','gamma','levels')
+
+def ImageArgs(params):
+    return RequestArgs(size=None,
+                       trf=parseTrf(params.get('trf')),
+                       contrast=_getEnhanceValue(params,'contrast'),
+                       brightness=_getEnhanceValue(params,'brightness'),
+                       gamma=_getGammaValue(params),
+                       levels=0.5 if params.get('autolevels') in ('1','true','True') else None)
+
+def ImageSize(session,params,trf=None):
+    """returns the size of the engraving of the loaded image, transformed by trf"""
+    size=EngraverData._thumbnailSize(session.loadedImage().size,(unitValue(params['width']),unitValue(params['height'])))
+    if trf and EngraverData.DIHEDRAL[EngraverData._composeTrf(trf)][1]:
+        size=size[::-1]
+    return size
+
+def SelectTone(session,params):
+    """remembers the tone adjustments of a preview for engraving; returns the image arguments"""
+    iargs=ImageArgs(params)
+    session.tone={k:getattr(iargs,k) for k in TONE_ARGS}
+    return iargs
+
+def RenderImagePreview(session,params,view=None):
+    """renders the preview of the loaded image; if the size of the view is given
+    a downscaled proxy fitting into it is rendered"""
+    iargs=SelectTone(session,params)
+    size=ImageSize(session,params)
+    if view:
+        size=ProxySize(size,view,iargs.trf)
+    return EngraverData.processImage(session.scaledImage(size),iargs)
+
+def _viewSize(params):
+    try:
+        view=(int(float(params['viewWidth'])),int(float(params['viewHeight'])))
+    except (KeyError,ValueError):
+        return None
+    return view if min(view)>0 else None
+
+def ProxySize(size,view,trf):
+    """returns size scaled down to fit into the view after transforming it"""
+    vw,vh=view
+    if EngraverData.DIHEDRAL[EngraverData._composeTrf(trf)][1]:
+        vw,vh=vh,vw
+    scale=min(1.,vw/size[0],vh/size[1])
+    return (max(1,int(size[0]*scale)),max(1,int(size[1]*scale)))
+
+
+# binary preview frames sent over the websocket:
+#   kind(1) flags(1) width(2) height(2) seq(4) followed by the packed 1-bit rows
+#   (MSB first, 1=white, rows padded to full bytes); with FRAME_DELTA set the rows
+#   are XORed with the previous frame, with FRAME_DEFLATE set they are zlib compressed.
+#   With FRAME_PROXY set the frame is a downscaled proxy and the header is followed
+#   by the engraving size: width(2) height(2)
+FRAME_HEADER=struct.Struct('!BBHHI')
+FRAME_FULLSIZE=struct.Struct('!HH')
+FRAME_PREVIEW=0x1
+FRAME_DELTA=0x1
+FRAME_DEFLATE=0x2
+FRAME_PROXY=0x4
+# parameters whose change still allows a delta against the previous frame
+DELTA_PARAMS=('contrast','brightness','gamma','autolevels')
+
+def PreviewFrame(client,cmdargs):
+    session=client.session
+    params={k:str(v) for k,v in cmdargs.items() if k not in ('seq','deflate')}
+    for p in params.get('mode')=='text' and TEXT_PARAMS or IMAGE_PARAMS:
+        if p not in params:
+            raise ValueError("parameter '%s' is missing"%p)
+    view=_viewSize(params)
+    if params.get('mode')=='text':
+        img=RenderTextPreview(session,params)
+        full=img.size
+        source=None
+        if view:
+            img.thumbnail(ProxySize(img.size,view,None))
+    else:
+        img=RenderImagePreview(session,params,view)
+        full=ImageSize(session,params,parseTrf(params.get('trf')))
+        source=session.imageid
+    if img.mode!='1':
+        img=img.convert('1',dither=Image.FLOYDSTEINBERG)
+    bits=img.tobytes()
+    key=(source,img.size,sorted((k,v) for k,v in params.items() if k not in DELTA_PARAMS))
+    flags=0
+    extra=b''
+    if img.size!=full:
+        flags|=FRAME_PROXY
+        extra=FRAME_FULLSIZE.pack(*full)
+    payload=bits
+    last=client.lastFrame
+    if last and last[0]==key:
+        payload=(int.from_bytes(last[1],'big')^int.from_bytes(bits,'big')).to_bytes(len(bits),'big')
+        flags|=FRAME_DELTA
+    client.lastFrame=(key,bits)
+    if cmdargs.get('deflate'):
+        payload=zlib.compress(payload,FRAME_ZLEVEL)
+        flags|=FRAME_DEFLATE
+    return FRAME_HEADER.pack(FRAME_PREVIEW,flags,img.width,img.height,int(cmdargs.get('seq',0))&0xffffffff)+extra+payload
+
+
 class GUIHandler(SimpleHTTPRequestHandler):
 
+    protocol_version="HTTP/1.1"
+    timeout=REQUEST_TIMEOUT
+
     def __init__(self,fd,addr,server):
         self.server=server
         self.hand_over=False
+        self.keep_alive=False
+        self.session=None
+        self.newSession=False
         return SimpleHTTPRequestHandler.__init__(self,fd,addr,server)
             
     def handle(self):
-        self.close_connection = 1
-
-        self.handle_one_request()
-        while not self.close_connection and not self.hand_over:
+        self.close_connection=True
+        self.HandleRequests()
+        if not self.close_connection and not self.hand_over:
+            # wait for the next request in the server loop instead of blocking it
+            self.keep_alive=True
+            self.server.KeepAlive(self)
+
+    def HandleRequests(self):
+        """handles the next request and the pipelined ones already received"""
+        while True:
+            self.session=None
             self.handle_one_request()
+            if self.close_connection or self.hand_over or not self._pending():
+                break
+
+    def _pending(self):
+        """returns True if the next request is already buffered"""
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
 
     def finish(self):
         if not self.wfile.closed:
@@ -426,13 +1072,39 @@ class GUIHandler(SimpleHTTPRequestHandler):
                 # A final socket error may have occurred here, such as
                 # the local error ECONNABORTED.
                 pass
-        if not self.hand_over:
+        if not self.hand_over and not self.keep_alive:
             self.wfile.close()
             self.rfile.close()
 
-    def _JSONHeader(self):
+    def Session(self):
+        """returns the session of the request; a new one is started if the request
+        has no valid session cookie"""
+        if not self.session:
+            cookie=SimpleCookie()
+            try:
+                cookie.load(self.headers.get("Cookie",""))
+            except Exception:
+                pass
+            sid=cookie[SESSION_COOKIE].value if SESSION_COOKIE in cookie else None
+            self.session=SESSIONS.get(sid)
+            self.newSession=self.session.id!=sid
+        return self.session
+
+    def end_headers(self):
+        if self.newSession:
+            self.send_header("Set-Cookie","%s=%s; Path=/; HttpOnly; SameSite=Strict"%(SESSION_COOKIE,self.session.id))
+            self.newSession=False
+        if not self.close_connection and not self.hand_over and not self.server.CanKeepAlive(self):
+            self.send_header("Connection","close")
+        SimpleHTTPRequestHandler.end_headers(self)
+
+    def _JSONHeader(self,length,etag=None):
         self.send_response(200)
         self.send_header("Content-Type","application/json; charset=utf-8");
+        self.send_header("Content-Length",str(length))
+        if etag:
+            self.send_header("ETag",etag)
+            self.send_header("Cache-Control","no-cache")
         self.end_headers()
 
     def log_message(self, format, *args):
@@ -462,10 +1134,14 @@ class GUIHandler(SimpleHTTPRequestHandler):
             self.send_header("Access-Control-Allow-Headers","x-websocket-protocol")
             self.send_header("Connection","Upgrade")
             self.send_header("Sec-WebSocket-Accept",self.GenSecAccept(key))
+            deflate=NegotiateDeflate(self.headers.get("Sec-WebSocket-Extensions"))
+            if deflate!=None:
+                self.send_header("Sec-WebSocket-Extensions",DeflateExtension(deflate))
             self.send_header("Upgrade","websocket")
             self.end_headers()
             self.server.KeepOpen()
-            ws=Websocket(self.request,self.server)
+            self.request.settimeout(None)
+            ws=Websocket(self.request,self.server,self.session,deflate)
         else:
             self.send_error(400,"illegal request")
 
@@ -476,96 +1152,111 @@ class GUIHandler(SimpleHTTPRequestHandler):
 
             
     def GetFonts(self,args):
-        exp=re.compile("\.(ttf|pfb)$")
-        fonts=list(filter(lambda f: exp.search(f,re.I)!=None,os.listdir(FONTDIR)))
-        fonts.sort()
-        digest=hashlib.sha1(bytes(str(fonts),'utf-8')).hexdigest()
-        flist=[]
-        if STORAGE.get('fonthash')!=digest:
-            for f in fonts:
-                try:
-                    fname=ImageFont.truetype('%s/%s'%(FONTDIR,f)).getname()
-                    fname="%s (%s)"%(fname[0],fname[1])
-                    flist.append({'name':fname,'file':f})
-                except:
-                    Logger.LOGGER.error("cannot load font from file '%s'\n",f)
-            STORAGE['fonts']=flist
-            STORAGE['fonthash']=digest
-        self._JSONHeader()
-        self.output(json.dumps(STORAGE['fonts']))
-
-    def SendImage(self,img):
+        etag,body=FONTINDEX.snapshot()
+        FONTINDEX.update()
+        if self.headers.get("If-None-Match")==etag:
+            self.send_response(304)
+            self.send_header("ETag",etag)
+            self.end_headers()
+            return
+        data=bytes(body,'utf-8')
+        self._JSONHeader(len(data),etag)
+        self.wfile.write(data)
+
+    def SendImage(self,img,key=None):
+        fd=PNGCACHE.get(key) if key else None
+        if not fd:
+            fd=EncodePNG(img)
+            if key:
+                PNGCACHE.put(key,fd)
         self.send_response(200)
         self.send_header("Pragma-directive","no-cache")
         self.send_header("Cache-directive","no-cache")
         self.send_header("Cache-Control","no-store, no-cache, must-revalidate")
         self.send_header("Content-Type","image/png");
-        self.end_headers()
-        fd = BytesIO()
-        img.save(fd, "png")
-        self.wfile.write(fd.getvalue())
+        with fd.getbuffer() as buf:
+            self.send_header("Content-Length",str(len(buf)))
+            self.end_headers()
+            self.wfile.write(buf)
         self.wfile.flush()
 
     
-    def RenderImageFromText(self,dict):
-        for p in ['text','font','width','height']:
+    def _params(self,dict,required):
+        for p in required:
             if  p not in dict:
                 self.send_error(404, "parameter '%s' is missing"%p)
-                return
-        hsh=hashlib.sha1()
-        global args 
-        args.text=dict['text'][0]
-        hsh.update(bytes(args.text,'utf-8'))
-        args.size=(unitValue(dict['width'][0]),unitValue(dict['height'][0]))
-        hsh.update(bytes(str(args.size),'utf-8'))
-        args.font="%s/%s"%(FONTDIR,dict['font'][0])
-        hsh.update(bytes(args.font,'utf-8'))
-
-        digest=hsh.hexdigest()
-        if STORAGE.get('imagehash')==digest:
-            img=STORAGE['textimage']
+                return None
+        return {k:v[0] for k,v in dict.items()}
+
+    def _sendPreview(self,render,select,params,key):
+        hit=PNGCACHE.get(key)!=None
+        CacheLookup('png',hit)
+        if hit:
+            select(self.session,params) # a cached preview is engraved like a rendered one
+            self.SendImage(None,key)
         else:
-            STORAGE['imagehash']=digest
-            img=EngraverData.imageFromText(args)
-            STORAGE['textimage']=img
-        args.trf=parseTrf(dict.get('trf',[None])[0])
-        self.SendImage(EngraverData._trfImage(img.copy(),args))
-
-    def _getEnhanceValue(self,dict,key):
-        res=None
-        val=dict.get(key)
-        if val and abs(float(val[0]))>0.001:
-            res=contrastBrightnessValue(val[0])
-        return res
-        
+            self.SendImage(render(self.session,params),key)
+
+    def RenderImageFromText(self,dict):
+        params=self._params(dict,TEXT_PARAMS)
+        if params!=None:
+            self._sendPreview(RenderTextPreview,SelectText,params,('text',tuple(sorted(params.items()))))
+
     def RenderImage(self,dict):
-        for p in ['width','height']:
-            if  p not in dict:
-                self.send_error(404, "parameter '%s' is missing"%p)
-                return
-        global args 
-        args.size=(unitValue(dict['width'][0]),unitValue(dict['height'][0]))
-        args.trf=parseTrf(dict.get('trf',[None])[0])
-        args.contrast=self._getEnhanceValue(dict,'contrast')
-        args.brightness=self._getEnhanceValue(dict,'brightness')
-        img=EngraverData.processImage(STORAGE['image'].copy(),args)
-        self.SendImage(img)
-        
-    
+        params=self._params(dict,IMAGE_PARAMS)
+        if params!=None:
+            self._sendPreview(RenderImagePreview,SelectTone,params,('image',self.session.imageid,tuple(sorted(params.items()))))
+
     def do_GET(self):
         dict={}
         l=self.path.split('?')
         if len(l)>1: dict=parse_qs(l[1])
+        if l[0] in self.sessionpaths:
+            self.Session()
         f=self.pathtofunc.get(l[0])
-        if not f:
-            self.path='/web%s'%self.path
-            self.log_message("path:'%s' => '%s'",self.path,self.translate_path(self.path))
-            if self.translate_path(self.path).startswith(os.getcwd()+os.sep+'web'):
-                SimpleHTTPRequestHandler.do_GET(self)
+        with Metrics.get().timer('kkengraver_http_request_seconds',method='GET',path=l[0] if f else 'static'):
+            if not f:
+                self.SendStatic(l[0])
             else:
-                self.send_error(404, "File not found")
+                f(self,dict)
+
+    def SendMetrics(self,args):
+        data=bytes(Metrics.get().export(),'utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type","text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length",str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def SendStatic(self,path):
+        path=self.translate_path('/%s%s'%(WEBDIR,path))
+        if os.path.isdir(path):
+            path=os.path.join(path,'index.html')
+        if not path.startswith(STATIC.root+os.sep):
+            self.send_error(404, "File not found")
+            return
+        e=STATIC.get(path,self.guess_type(path))
+        if not e:
+            self.send_error(404, "File not found")
+            return
+        enc=StaticFiles.encoding(e,self.headers.get("Accept-Encoding"))
+        data,etag=e['variants'][enc]
+        modified=etag not in self.headers.get("If-None-Match",'')
+        if not modified:
+            self.send_response(304)
         else:
-            f(self,dict)
+            self.send_response(200)
+            self.send_header("Content-Type",e['ctype'])
+            self.send_header("Content-Length",str(len(data)))
+            if enc!='identity':
+                self.send_header("Content-Encoding",enc)
+        self.send_header("ETag",etag)
+        self.send_header("Cache-Control",e['cache'])
+        if len(e['variants'])>1:
+            self.send_header("Vary","Accept-Encoding")
+        self.end_headers()
+        if modified:
+            self.wfile.write(data)
 
      
     def do_POST(self):
@@ -574,50 +1265,94 @@ class GUIHandler(SimpleHTTPRequestHandler):
         if not f:
             self.send_error(404, "File not found")
         else:
-            f(self)
+            self.Session()
+            with Metrics.get().timer('kkengraver_http_request_seconds',method='POST',path=l[0]):
+                f(self)
 
     
     def SaveImage(self):
-        global args
-        content_length = int(self.headers['Content-Length'])
-        ctype, pdict = cgi.parse_header(self.headers['Content-Type'])
-        if ctype == 'multipart/form-data':
-            encoding='utf-8'
-            errors='replace'
-            boundary = pdict['boundary']
-            ctype = self.headers['Content-Type']
-            headers = cgi.Message()
-            headers.set_type(ctype)
-            headers['Content-Length'] = self.headers['Content-Length']
-            fs = cgi.FieldStorage(self.rfile, headers=headers, encoding=encoding, errors=errors,
-                              environ={'REQUEST_METHOD': 'POST'})
+        try:
+            content_length = int(self.headers['Content-Length'])
+        except (TypeError,ValueError):
+            self.send_error(411,"content length required")
+            return
+        if content_length>MAXUPLOAD:
+            self.close_connection=True
+            self.send_error(413,"image file too large","at most %d bytes are allowed"%MAXUPLOAD)
+            return
+        boundary=self.headers.get_param('boundary')
+        if self.headers.get_content_type()=='multipart/form-data' and boundary:
             try:
-                image=fs['file']
-                data=fs.getlist('file')[0]
-            except:
-                image=None
-            if image!=None:
-                fd=BytesIO(data)
-                StoreImage(fd)
+                fd=MultipartReader(self.rfile,boundary,content_length).read('file')
+            except ValueError as ex:
+                self.close_connection=True
+                self.send_error(400,str(ex))
+                return
+            if fd!=None:
+                try:
+                    self.session.store(fd)
+                except Exception as ex:
+                    fd.close()
+                    self.send_error(400,"cannot read image",str(ex))
+                    return
                 self.send_response(200)
+                self.send_header("Content-Length","0")
                 self.end_headers()
             else: 
-                self.send_error(400,"content dispostion `file0` expected\n",'utf-8')
+                self.send_error(400,"content dispostion `file0` expected")
         else:
-            self.send_error(400,"content type `multipart/form-data` expected\n",'utf-8')
+            self.send_error(400,"content type `multipart/form-data` expected")
 
     pathtofunc={
         '/ws':CreateWS,
         '/fonts':GetFonts,
         '/textimage':RenderImageFromText,
-        '/image':RenderImage
+        '/image':RenderImage,
+        '/metrics':SendMetrics
         }
     
     ppathtofunc={
         '/image':SaveImage
         }
+
+    # only these requests need a session; others must not start one
+    sessionpaths=('/ws','/textimage','/image')
     
 
+class KeptConnection(object):
+    """an idle HTTP/1.1 connection waiting in the server loop for its next request"""
+
+    def __init__(self,handler,registry):
+        self.handler=handler
+        self.registry=registry
+        self.socket=handler.request
+        self.fileno=lambda s=self: s.socket
+        self.lastused=time.time()
+
+    def DoRead(self):
+        self.lastused=time.time()
+        handler=self.handler
+        handler.HandleRequests()
+        self.registry.do_close=True # an upgrade to a websocket calls KeepOpen
+        if handler.hand_over:
+            self.registry.connections.discard(self)
+        elif handler.close_connection:
+            self.DoClose()
+
+    def DoWrite(self,data):
+        pass
+
+    def DoClose(self):
+        self.registry.connections.discard(self)
+        self.registry.Unregister(self)
+        for f in (self.handler.wfile,self.handler.rfile):
+            try:
+                f.close()
+            except OSError:
+                pass
+        self.registry.shutdown_request(self.socket)
+
+
 class Httpd(HTTPServer):
 
     allow_reuse_address = True
@@ -629,6 +1364,8 @@ class Httpd(HTTPServer):
         self.msg=None
         self.do_close=True
         self.messageHandler=lambda p: None
+        self.connections=set()
+        self.traffic=[0,0] # websocket bytes before and after compression
         self.Register(self)
         self.lock=threading.Lock()
         
@@ -644,6 +1381,21 @@ class Httpd(HTTPServer):
     def KeepOpen(self):
         self.do_close=False
         
+    def KeepAlive(self,handler):
+        self.KeepOpen()
+        conn=KeptConnection(handler,self)
+        self.connections.add(conn)
+        self.Register(conn)
+
+    def CanKeepAlive(self,handler):
+        """returns False if the connection must be closed to stay below MAXCONNECTIONS"""
+        return handler.keep_alive or len(self.connections)<MAXCONNECTIONS
+
+    def CloseIdle(self):
+        limit=time.time()-KEEPALIVE_TIMEOUT
+        for conn in [c for c in self.connections if c.lastused<limit]:
+            conn.DoClose()
+
     def shutdown_request(self, request):
         if self.do_close:
             HTTPServer.shutdown_request(self,request)
@@ -689,18 +1441,41 @@ class Httpd(HTTPServer):
                     print(n)
                     self.HandleClose(ready)
             for failed in xList:
-                self.HandleClose(ready)
+                self.HandleClose(failed)
+            self.CloseIdle()
 
     def Send(self,obj):
-        self.lock.acquire()
         msg=json.dumps(obj)
-        for client in self.listeners.values():
-            client.DoWrite(msg)
-        self.lock.release()
+        with self.lock:
+            for client in list(self.listeners.values()):
+                try:
+                    client.DoWrite(msg)
+                except OSError:
+                    pass # a closed client is removed by the server loop
+
+    def SendTo(self,client,msg,compress=True):
+        with self.lock:
+            client.DoWrite(msg,compress)
 
-    def Receive(self,msg):
+    def Traffic(self,raw=0,sent=0):
+        """counts the bytes sent over websockets; returns the totals"""
+        self.traffic[0]+=raw
+        self.traffic[1]+=sent
+        return tuple(self.traffic)
+
+    def Receive(self,msg,client=None):
         obj=json.loads(msg)
-        self.messageHandler.receive(obj)
+        if obj.get('cmd')=='preview' and client:
+            try:
+                params=obj.get('args',{})
+                with Metrics.get().timer('kkengraver_http_request_seconds',method='WS',path='preview'):
+                    frame=PreviewFrame(client,params)
+                # deflated frames do not shrink any further
+                self.SendTo(client,frame,not params.get('deflate'))
+            except Exception as ex:
+                Logger.LOGGER.error("cannot render preview: %s\n",ex)
+        else:
+            self.messageHandler.receive(obj,client.session if client else None)
 
 class StdoutClient(object):
     def DoWrite(self,msg):
@@ -723,6 +1498,7 @@ class ExternalLogger(Logger):
 
     def log(self,severity,fmt,*args):
         lev=self.LEVELS.get(severity,99)
+        Metrics.get().inc('kkengraver_log_messages_total',severity=severity)
         if lev<self.LEVELS["WARN"]:
             self.success=False
         if self.verbosity>=lev:
@@ -734,6 +1510,47 @@ class ExternalLogger(Logger):
         return res
 
 
+class CommandQueue(object):
+    """a bounded priority queue for the commands of the worker; urgent commands
+    are run first, redundant status requests are merged and put never blocks.
+    A frameStop never overtakes its frameStart"""
+    URGENT=('stopEngraving','frameStop')
+    COALESCE=('status','nop') # both only lead to a status update
+
+    def __init__(self,size=16):
+        self.size=size
+        self.entries=[]
+        self.seq=itertools.count()
+        self.cond=threading.Condition()
+
+    def put(self,item):
+        """queues an item (msg,session); returns False if the queue is full"""
+        name=item[0].get('cmd')
+        prio=0 if name in self.URGENT else 1
+        with self.cond:
+            if name=='frameStop':
+                starts=[e for e in self.entries if e[2][0].get('cmd')=='frameStart']
+                if starts:
+                    # the frame has not been started yet, so neither is run
+                    self.entries.remove(starts[-1])
+                    heapq.heapify(self.entries)
+                    item=({'cmd':'status'},item[1])
+                    name,prio='status',1
+            if name in self.COALESCE and any(e[2][0].get('cmd') in self.COALESCE for e in self.entries):
+                return True
+            if prio and len(self.entries)>=self.size:
+                return False
+            heapq.heappush(self.entries,(prio,next(self.seq),item))
+            self.cond.notify()
+        return True
+
+    def get(self):
+        with self.cond:
+            while not self.entries:
+                self.cond.wait()
+            return heapq.heappop(self.entries)[2]
+
+
 class Worker(threading.Thread):
     def __init__(self,engraver,channel):
         self.engraver=engraver
@@ -745,7 +1562,9 @@ class Worker(threading.Thread):
         self.centerAxis=None
         self.useCenter=False
         self.burner=None
-        self.queue=queue.Queue(1)
+        self.estimate=None
+        self.traffic=None
+        self.queue=CommandQueue()
         self.commands={
             'connect':self.connect,
             'disconnect':self.disconnect,
@@ -781,9 +1600,16 @@ class Worker(threading.Thread):
                'fanOn':engraver.isFanOn(),
                'success':Logger.LOGGER.resetError(),
                'centerAxis':self.centerAxis,
-               'useCenter':self.useCenter
+               'useCenter':self.useCenter,
+               'estimate':self.remaining()
                }
 
+    def remaining(self):
+        if not (self.engraving and self.estimate):
+            return None
+        transfer,burn,start=self.estimate
+        return {'transfer':transfer,'burn':burn,'remaining':max(0,start+transfer+burn-time.time())}
+
     def frameStart(self,engraver,fx,fy,useCenter,centerAxis):
         self.centerAxis=centerAxis
         self.useCenter=useCenter
@@ -794,17 +1620,24 @@ class Worker(threading.Thread):
         self.framing=False
         engraver.frameStop(fx,fy,useCenter,centerAxis)
 
-    def engrave(self,engraver,mode,useCenter,trf,width,height,power,depth):
-        global args
+    def engrave(self,engraver,mode,useCenter,trf,width,height,power,depth,session=None):
+        session=session or Session(None)
+        eargs=dict(size=(width,height),trf=parseTrf(trf),power=power,depth=depth)
         if mode=='image':
-            img=STORAGE['image'].copy()
+            img=session.loadedImage().copy()
+            eargs.update(session.tone)
         else:
-            img=STORAGE['textimage'].copy()
-        args.size=(width,height)
-        args.trf=parseTrf(trf)
-        args.power=power
-        args.depth=depth
-        data=EngraverData._imageToData(img,args)
+            img=session.lastText()
+            if img==None:
+                Logger.LOGGER.error("no text to engrave\n")
+                return
+            img=img.copy()
+            eargs.update((k,None) for k in TONE_ARGS)
+        data=EngraverData._imageToData(img,RequestArgs(**eargs))
+        self.estimate=None
+        if isinstance(data,(EngraverData,list)): # tiles are generated while burning
+            self.estimate=estimateJobs([data] if isinstance(data,EngraverData) else data)+(time.time(),)
+        self.traffic=self.channel.Traffic()
         self.burner=BurnThread(self,engraver,data,useCenter)
         self.burner.start()
         self.engraving=True
@@ -815,11 +1648,14 @@ class Worker(threading.Thread):
             
     def run(self):
         while not self.doStop:
-            msg=self.queue.get()
+            msg,session=self.queue.get()
             self.busy=True
             cmd=self.commands.get(msg.get('cmd'))
             if cmd:
-                res=cmd(self.engraver,**msg.get('args',{}))
+                kw=msg.get('args',{})
+                if cmd==self.engrave:
+                    kw=dict(kw,session=session)
+                res=cmd(self.engraver,**kw)
                 if res!=None:
                     self.channel.Send(res)
             else:
@@ -832,12 +1668,22 @@ class Worker(threading.Thread):
         self.receive({"cmd":"nop"})
 
 
-    def receive(self,obj):
-        self.queue.put(obj)
+    def receive(self,obj,session=None):
+        """queues a command; it is called by the server loop and must not block"""
+        if obj.get('cmd')=='stopEngraving':
+            # interrupt the burn at once instead of waiting for the running command
+            self.stopEngraving(self.engraver)
+            obj={'cmd':'status'}
+        if not self.queue.put((obj,session)):
+            Logger.LOGGER.error("engraver is busy; command '%s' is ignored\n",obj.get('cmd'))
 
     def engravingDone(self):
         self.engraving=False
         self.burner=None
+        if self.traffic:
+            raw,sent=[b-a for a,b in zip(self.traffic,self.channel.Traffic())]
+            Logger.LOGGER.info("websocket traffic of the job: %d bytes, %d bytes saved by compression\n",sent,raw-sent)
+            self.traffic=None
         self.receive({"cmd":"nop"})
         
 class UrlOpener(threading.Thread):
@@ -845,7 +1691,7 @@ class UrlOpener(threading.Thread):
         self.port=port
         self.host=host
         self.browser=None
-        
+        import webbrowser
         if not bname:
             self.browser=webbrowser.get()
         else:
@@ -875,60 +1721,70 @@ class BurnThread(threading.Thread):
         self.worker=worker
               
     def run(self):
-        self.thread_id=threading.current_thread().ident
         engraver.burn(self.data,self.useCenter)
         worker.engravingDone()
            
     def pause(self): 
-        res = ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_long(self.thread_id),ctypes.py_object(KeyboardInterrupt))
-        if res != 1: 
-            print('Exception raise failure') 
+        self.engraver.interrupt()
 
 
-UI.setAsk(lambda msg: True)
+if __name__ == '__main__':
 
-parser = argparse.ArgumentParser(description=DESCRIPTION,formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    UI.setAsk(lambda msg: True)
 
-parser.add_argument('-d', '--device',metavar="device",help='the serial device',default="/dev/ttyUSB0")
-parser.add_argument('-s', '--speed',metavar="speed",help='the speed of the serial device',type=int,default=115200)
-parser.add_argument('-v', '--verbosity',help='increase verbosity level ',action='count',default=0)
-parser.add_argument('--limit', help='set maximum no. of steps in x/y direction',metavar=('steps'),dest='lim',type=int,default=1575)
-parser.add_argument('-b', '--browser',metavar="browser",help='use browser to open gui, set to - to not open the gui',default='')
-parser.add_argument('-B', '--bind',metavar="bind",help='use the given address to bind to; use 0.0.0.0 for all interfaces',
-                    default='127.0.0.1')
-
-parser.add_argument('-P', '--port',metavar="port",help='use the given port',
-                    default=8008)
-
-parser.add_argument('-T','--transform', help=argparse.SUPPRESS,dest='trf')
-parser.add_argument('--dry-run',dest='dummy', help=argparse.SUPPRESS)
-parser.add_argument('--invert',dest='invert', help=argparse.SUPPRESS,default=False,action='store_true')
-parser.add_argument('--brightness',dest='brightness', help=argparse.SUPPRESS,default=None)
-parser.add_argument('--contrast',dest='contrast', help=argparse.SUPPRESS,default=None)
-
-args = parser.parse_args()
-
-
-if args.browser!='-':
-    if args.bind not in ['0.0.0.0','127.0.0.1']:
-        host=args.bind
-    else:
-        host='localhost'
-    UrlOpener(args.browser,host,args.port).start()
-
-httpd = Httpd(args.bind,args.port)
-httpd.Register(StdoutClient())
-Logger.set(ExternalLogger(args.verbosity,httpd))
-engraver=Engraver(args)
-worker=Worker(engraver,httpd)
-httpd.SetMessageHandler(worker)
-StoreImage('web/logo.png')
-worker.start()
-httpd.Loop()
+    parser = argparse.ArgumentParser(description=DESCRIPTION,formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
+    parser.add_argument('-d', '--device',metavar="device",help='the serial device; use replay:<file> to simulate the engraver of a trace recorded with --record',default="/dev/ttyUSB0")
+    parser.add_argument('-s', '--speed',metavar="speed",help='the speed of the serial device',type=int,default=115200)
+    parser.add_argument('--record',metavar='file',help='record the serial traffic with timestamps to a trace file; see serialtrace.py',default=None)
+    parser.add_argument('-v', '--verbosity',help='increase verbosity level ',action='count',default=0)
+    parser.add_argument('--limit', help='set maximum no. of steps in x/y direction',metavar=('steps'),dest='lim',type=int,default=1575)
+    parser.add_argument('-b', '--browser',metavar="browser",help='use browser to open gui, set to - to not open the gui',default='')
+    parser.add_argument('-B', '--bind',metavar="bind",help='use the given address to bind to; use 0.0.0.0 for all interfaces',
+                        default='127.0.0.1')
 
+    parser.add_argument('-P', '--port',metavar="port",help='use the given port',
+                        type=int,default=8008)
 
+    parser.add_argument('--history',metavar='file', help='the file for recording the times of engraving jobs; it is used to calibrate the estimation of the engraving time',
+                        default=HISTORY)
 
+    parser.add_argument('-T','--transform', help=argparse.SUPPRESS,dest='trf')
+    parser.add_argument('--dry-run',dest='dummy', help=argparse.SUPPRESS)
+    parser.add_argument('--invert',dest='invert', help=argparse.SUPPRESS,default=False,action='store_true')
+    parser.add_argument('--layers',dest='layers', help=argparse.SUPPRESS,type=int,default=None)
+    parser.add_argument('--tile',dest='tile', help=argparse.SUPPRESS,type=int,default=None)
+    parser.add_argument('--auto-orient',dest='orient', help=argparse.SUPPRESS,default=False,action='store_true')
+    parser.add_argument('--brightness',dest='brightness', help=argparse.SUPPRESS,default=None)
+    parser.add_argument('--contrast',dest='contrast', help=argparse.SUPPRESS,default=None)
+    parser.add_argument('--gamma',dest='gamma', help=argparse.SUPPRESS,default=None)
+    parser.add_argument('--auto-levels',dest='levels', help=argparse.SUPPRESS,default=None)
 
+    args = parser.parse_args()
 
 
+    if args.browser!='-':
+        if args.bind not in ['0.0.0.0','127.0.0.1']:
+            host=args.bind
+        else:
+            host='localhost'
+        UrlOpener(args.browser,host,args.port).start()
+
+    httpd = Httpd(args.bind,args.port)
+    httpd.Register(StdoutClient())
+    Logger.set(ExternalLogger(args.verbosity,httpd))
+    metrics=Metrics.get()
+    metrics.gauge('kkengraver_websocket_clients',lambda: sum(isinstance(c,Websocket) for c in list(httpd.listeners.values())),'connected websocket clients')
+    metrics.gauge('kkengraver_http_connections',lambda: len(httpd.connections),'idle HTTP connections kept alive')
+    metrics.gauge('kkengraver_sessions',lambda: len(SESSIONS.entries),'browser sessions')
+    BurnModel.set(BurnModel(args.history))
+    FONTINDEX=FontIndex(FONTDIR)
+    STATIC=StaticFiles(WEBDIR)
+    FONTINDEX.start()
+    engraver=Engraver(args)
+    worker=Worker(engraver,httpd)
+    metrics.gauge('kkengraver_queue_depth',lambda: len(worker.queue.entries),'commands waiting for the worker')
+    httpd.SetMessageHandler(worker)
+    Session.LOGO=DecodeImage('web/logo.png')
+    worker.start()
+    httpd.Loop()
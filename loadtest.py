@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import sys
+import os
+import time
+import json
+import socket
+import struct
+import base64
+import argparse
+import threading
+import subprocess
+import http.client
+
+from urllib.parse import urlencode
+
+LOADTEST_HISTORY=os.path.join(os.path.expanduser('~'),'.kkengraver','loadtest.jsonl')
+LOADTEST_IMAGE=os.path.join(os.path.dirname(os.path.abspath(__file__)),'web','images','screen.png')
+SESSION_COOKIE='kksession'
+
+########################################################################
+
+class WSClient(object):
+    """a minimal websocket client sending JSON commands and receiving frames"""
+
+    def __init__(self,host,port,cookie=None):
+        self.socket=socket.create_connection((host,port))
+        key=base64.b64encode(os.urandom(16)).decode('ascii')
+        self.socket.sendall(("GET /ws HTTP/1.1\r\nHost: %s:%d\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                             "Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n%s\r\n"
+                             %(host,port,key,"Cookie: %s\r\n"%cookie if cookie else "")).encode('ascii'))
+        self.rfile=self.socket.makefile('rb')
+        status=self.rfile.readline()
+        if b' 101 ' not in status:
+            raise IOError("websocket upgrade failed: %s"%status.decode('latin-1').strip())
+        while self.rfile.readline() not in (b'\r\n',b''):
+            pass
+
+    def send(self,obj):
+        data=json.dumps(obj).encode('utf-8')
+        mask=os.urandom(4)
+        head=bytearray([0x81])
+        if len(data)<126:
+            head.append(0x80|len(data))
+        elif len(data)<65536:
+            head.append(0x80|126)
+            head+=struct.pack('!H',len(data))
+        else:
+            head.append(0x80|127)
+            head+=struct.pack('!Q',len(data))
+        self.socket.sendall(bytes(head)+mask+bytes(b^mask[i%4] for i,b in enumerate(data)))
+
+    def receive(self):
+        """returns the opcode and payload of the next message"""
+        b1,b2=self.rfile.read(2)
+        size=b2&0x7f
+        if size==126:
+            size=struct.unpack('!H',self.rfile.read(2))[0]
+        elif size==127:
+            size=struct.unpack('!Q',self.rfile.read(8))[0]
+        return b1&0x0f,self.rfile.read(size)
+
+    def close(self):
+        self.socket.close()
+
+
+class Results(object):
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.latencies={}
+        self.errors={}
+        self.reasons={}
+
+    def add(self,path,latency):
+        with self.lock:
+            self.latencies.setdefault(path,[]).append(latency)
+
+    def error(self,path,ex):
+        with self.lock:
+            self.errors[path]=self.errors.get(path,0)+1
+            self.reasons.setdefault(path,str(ex) or type(ex).__name__)
+
+    def summary(self,duration):
+        res={}
+        for path in sorted(set(self.latencies)|set(self.errors)):
+            lat=sorted(self.latencies.get(path,[]))
+            res[path]={'requests':len(lat),'errors':self.errors.get(path,0),
+                       'throughput':len(lat)/duration,
+                       'p50':percentile(lat,0.5)*1000.,'p99':percentile(lat,0.99)*1000.}
+            if path in self.reasons:
+                res[path]['error']=self.reasons[path]
+        return res
+
+def percentile(values,p):
+    if not values:
+        return 0.
+    return values[min(len(values)-1,int(len(values)*p))]
+
+
+def paced(rate,stop):
+    """yields the scheduled times of requests at the given rate until stop is set;
+    latencies are measured from the scheduled time, so a slow server is not hidden
+    by requests that are sent late"""
+    start=time.perf_counter()
+    k=0
+    while not stop.is_set():
+        due=start+k/rate
+        wait=due-time.perf_counter()
+        if wait>0 and stop.wait(wait):
+            break
+        yield due
+        k+=1
+
+
+def newSession(opts):
+    """starts a session on the server like a browser and uploads the test image to it;
+    returns the session cookie"""
+    conn=http.client.HTTPConnection(opts.host,opts.port,timeout=30)
+    conn.request('GET','/image?'+urlencode({'width':1,'height':1}))
+    resp=conn.getresponse()
+    resp.read()
+    cookie=[c.split(';')[0] for c in resp.headers.get_all('Set-Cookie') or [] if c.startswith(SESSION_COOKIE+'=')]
+    if not cookie:
+        raise IOError("the server did not start a session")
+    boundary=base64.b16encode(os.urandom(8)).decode('ascii')
+    with open(opts.image,'rb') as fd:
+        body=(("--%s\r\nContent-Disposition: form-data; name=\"file\"; filename=\"%s\"\r\n"
+               "Content-Type: application/octet-stream\r\n\r\n"%(boundary,os.path.basename(opts.image))).encode('utf-8')
+              +fd.read()+("\r\n--%s--\r\n"%boundary).encode('ascii'))
+    conn.request('POST','/image',body,{'Content-Type':'multipart/form-data; boundary=%s'%boundary,'Cookie':cookie[0]})
+    resp=conn.getresponse()
+    resp.read()
+    conn.close()
+    if resp.status!=200:
+        raise IOError("cannot upload %s: status %d"%(opts.image,resp.status))
+    return cookie[0]
+
+
+def varied(params,k):
+    """returns the parameters of the k-th request; they change with every request,
+    so the previews are rendered instead of taken from the caches of the server"""
+    params=dict(params)
+    if params['mode']=='text':
+        params['height']=str(int(params['height'])+k%97)
+    else:
+        params['contrast']='%.1f'%((k*37)%201/10.-10.)
+    return params
+
+
+def wsLoad(opts,results,stop,ready):
+    try:
+        ws=WSClient(opts.host,opts.port,newSession(opts))
+    except Exception as ex:
+        results.error('ws preview',ex)
+        ready.release()
+        return
+    ready.release()
+    seq=0
+    try:
+        for due in paced(opts.ws_rate,stop):
+            seq+=1
+            params=opts.text_params if opts.text and seq%2==0 else opts.image_params
+            args=dict(varied(params,seq),seq=seq,deflate=True)
+            ws.send({'cmd':'preview','args':args})
+            while True:
+                op,data=ws.receive()
+                if op==0x2 and struct.unpack_from('!I',data,6)[0]==seq:
+                    break
+            results.add('ws preview',time.perf_counter()-due)
+    except Exception as ex:
+        if not stop.is_set():
+            results.error('ws preview',ex)
+    finally:
+        ws.close()
+
+
+def httpLoad(opts,path,params,cookie,results,stop):
+    conn=http.client.HTTPConnection(opts.host,opts.port,timeout=30)
+    for k,due in enumerate(paced(opts.http_rate,stop)):
+        try:
+            conn.request('GET',path+'?'+urlencode(varied(params,k)),headers={'Cookie':cookie})
+            resp=conn.getresponse()
+            resp.read()
+            if resp.status!=200:
+                raise IOError("status %d"%resp.status)
+            results.add(path,time.perf_counter()-due)
+        except Exception as ex:
+            results.error(path,ex)
+            conn.close()
+    conn.close()
+
+
+class ServerStats(object):
+    """samples the CPU time and resident memory of the server process from /proc"""
+
+    def __init__(self,pid):
+        self.pid=pid
+        self.maxrss=0
+        self.start=self.cpu()
+
+    def cpu(self):
+        try:
+            with open('/proc/%d/stat'%self.pid) as fd:
+                fields=fd.read().rsplit(')',1)[1].split()
+            return (int(fields[11])+int(fields[12]))/os.sysconf('SC_CLK_TCK')
+        except (OSError,ValueError,TypeError):
+            return None
+
+    def sample(self):
+        try:
+            with open('/proc/%d/status'%self.pid) as fd:
+                for line in fd:
+                    if line.startswith('VmRSS:'):
+                        self.maxrss=max(self.maxrss,int(line.split()[1])/1024.)
+        except (OSError,ValueError,TypeError):
+            pass
+
+    def used(self):
+        end=self.cpu()
+        return None if end==None or self.start==None else end-self.start
+
+
+def startServer(opts):
+    cmd=[sys.executable,os.path.join(os.path.dirname(os.path.abspath(__file__)),'gui.py'),'-b','-','-P',str(opts.port)]
+    if opts.trace:
+        cmd+=['-d','replay:%s'%opts.trace]
+    server=subprocess.Popen(cmd,stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    for i in range(100):
+        try:
+            socket.create_connection((opts.host,opts.port),timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise IOError("the server did not start")
+
+
+def fontName(opts):
+    conn=http.client.HTTPConnection(opts.host,opts.port,timeout=10)
+    conn.request('GET','/fonts')
+    fonts=json.loads(conn.getresponse().read())
+    conn.close()
+    return fonts[0]['file'] if fonts else None
+
+
+def run(opts):
+    server=startServer(opts) if opts.spawn else None
+    try:
+        pid=server.pid if server else opts.pid
+        if server and opts.trace: # connect the simulated engraver like a browser would
+            ws=WSClient(opts.host,opts.port)
+            ws.send({'cmd':'connect'})
+            ws.close()
+        opts.image_params={'mode':'image','width':opts.width,'height':opts.height,'contrast':'0','brightness':'0'}
+        font=fontName(opts) if opts.text else None
+        opts.text=opts.text if font else None
+        opts.text_params={'mode':'text','text':opts.text,'font':font,'width':opts.width,'height':opts.height}
+        results=Results()
+        stats=ServerStats(pid) if pid else None
+        stop=threading.Event()
+        ready=threading.Semaphore(0)
+        threads=[threading.Thread(target=wsLoad,args=(opts,results,stop,ready)) for i in range(opts.clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            ready.acquire()
+        http=[]
+        if opts.http_rate>0:
+            cookie=newSession(opts) # one browser fetching both kinds of previews
+            http.append(threading.Thread(target=httpLoad,args=(opts,'/image',opts.image_params,cookie,results,stop)))
+            if opts.text:
+                http.append(threading.Thread(target=httpLoad,args=(opts,'/textimage',opts.text_params,cookie,results,stop)))
+        for t in http:
+            t.start()
+        if stats:
+            stats=ServerStats(pid)
+        start=time.perf_counter()
+        while time.perf_counter()-start<opts.duration:
+            time.sleep(0.2)
+            if stats:
+                stats.sample()
+        stop.set()
+        duration=time.perf_counter()-start
+        cpu=stats.used() if stats else None
+        for t in threads+http:
+            t.join(30)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    return {'time':time.time(),'commit':gitCommit(),
+            'params':{'clients':opts.clients,'ws_rate':opts.ws_rate,'http_rate':opts.http_rate,
+                      'duration':opts.duration,'size':[opts.width,opts.height],'text':bool(opts.text),
+                      'image':os.path.basename(opts.image)},
+            'paths':results.summary(duration),
+            'server':{'cpu':None if cpu==None else cpu/duration*100.,'rss':stats.maxrss if stats else None}}
+
+
+def gitCommit():
+    try:
+        return subprocess.run(['git','rev-parse','--short','HEAD'],stdout=subprocess.PIPE,stderr=subprocess.DEVNULL,
+                              cwd=os.path.dirname(os.path.abspath(__file__)),universal_newlines=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def previousRun(path,params):
+    """returns the last recorded run with the same parameters"""
+    last=None
+    try:
+        with open(path) as fd:
+            for line in fd:
+                try:
+                    res=json.loads(line)
+                except ValueError:
+                    continue
+                if res.get('params')==params:
+                    last=res
+    except OSError:
+        pass
+    return last
+
+
+def report(res,prev):
+    print("%-12s %9s %7s %9s %9s %9s"%('path','requests','errors','req/s','p50 ms','p99 ms'))
+    for path,r in res['paths'].items():
+        line="%-12s %9d %7d %9.1f %9.1f %9.1f"%(path,r['requests'],r['errors'],r['throughput'],r['p50'],r['p99'])
+        old=prev and prev['paths'].get(path)
+        if old and old['p99']>0:
+            line+="   p99 %+.0f%% vs %s"%((r['p99']/old['p99']-1.)*100.,prev.get('commit') or 'last run')
+        if r.get('error'):
+            line+="   first error: %s"%r['error']
+        print(line)
+    srv=res['server']
+    if srv['cpu']!=None:
+        print("server cpu %.0f%%  max rss %.1f MB"%(srv['cpu'],srv['rss']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='load test for the web server of gui.py',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-H','--host',default='localhost',help='the host of the server')
+    parser.add_argument('-P','--port',type=int,default=8008,help='the port of the server')
+    parser.add_argument('-n','--clients',type=int,default=4,help='number of websocket clients')
+    parser.add_argument('-r','--ws-rate',type=float,default=5.,metavar='n',help='preview requests per second of each websocket client')
+    parser.add_argument('--http-rate',type=float,default=2.,metavar='n',help='requests per second to /image and /textimage each; 0 to disable')
+    parser.add_argument('-d','--duration',type=float,default=10.,metavar='secs',help='duration of the test')
+    parser.add_argument('-S','--size',nargs=2,default=['800','600'],metavar=('w','h'),help='the size of the previews')
+    parser.add_argument('-i','--image',default=LOADTEST_IMAGE,metavar='imagefile',help='the image uploaded by every client')
+    parser.add_argument('-t','--text',default='Load test',help='the text of text previews; empty to disable them')
+    parser.add_argument('--spawn',action='store_true',default=False,help='start gui.py for the test and stop it afterwards')
+    parser.add_argument('--trace',metavar='file',default=None,help='with --spawn: simulate the engraver by replaying this serial trace')
+    parser.add_argument('--pid',type=int,default=None,help='the process id of a running server for measuring its CPU and memory usage')
+    parser.add_argument('--history',metavar='file',default=LOADTEST_HISTORY,help='the file the results are appended to; - to not record them')
+    opts=parser.parse_args()
+    opts.width,opts.height=opts.size
+    res=run(opts)
+    prev=previousRun(opts.history,res['params']) if opts.history!='-' else None
+    report(res,prev)
+    if opts.history!='-':
+        os.makedirs(os.path.dirname(os.path.abspath(opts.history)),exist_ok=True)
+        with open(opts.history,'a') as fd:
+            fd.write(json.dumps(res)+'\n')
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import sys
+import time
+import struct
+import threading
+import argparse
+import heapq
+
+########################################################################
+#
+# trace file: MAGIC followed by records of
+#   kind(1) microseconds since the previous record(4) length(2) data
+# kind is WRITE for bytes sent to the engraver and READ for bytes received
+#
+
+MAGIC=b'KKST\x01'
+RECORD=struct.Struct('!BIH')
+WRITE=ord('W')
+READ=ord('R')
+REPLAY_PREFIX='replay:'
+
+class TraceWriter(object):
+    def __init__(self,path):
+        self.fd=open(path,'wb',buffering=0) # the trace must survive a crash
+        self.fd.write(MAGIC)
+        self.last=time.monotonic()
+        self.lock=threading.Lock()
+
+    def record(self,kind,data):
+        with self.lock:
+            now=time.monotonic()
+            delta=min(0xffffffff,int((now-self.last)*1e6))
+            self.last=now
+            for i in range(0,max(1,len(data)),0xffff):
+                chunk=data[i:i+0xffff]
+                self.fd.write(RECORD.pack(kind,delta,len(chunk))+chunk)
+                delta=0
+
+    def close(self):
+        with self.lock:
+            self.fd.close()
+
+
+def readTrace(path):
+    """returns the records of a trace as (kind,secs since start,data)"""
+    with open(path,'rb') as fd:
+        if fd.read(len(MAGIC))!=MAGIC:
+            raise ValueError("%s is not a serial trace"%path)
+        buf=fd.read()
+    res=[]
+    t=0
+    pos=0
+    while pos+RECORD.size<=len(buf):
+        kind,delta,size=RECORD.unpack_from(buf,pos)
+        pos+=RECORD.size
+        t+=delta/1e6
+        res.append((kind,t,bytes(buf[pos:pos+size])))
+        pos+=size
+    return res
+
+
+class Recorder(object):
+    """wraps a serial device and records every write and read to a trace file"""
+
+    def __init__(self,ser,path):
+        self.ser=ser
+        self.trace=TraceWriter(path)
+
+    def write(self,data):
+        self.trace.record(WRITE,bytes(data))
+        return self.ser.write(data)
+
+    def read(self,size=1):
+        data=self.ser.read(size)
+        if data:
+            self.trace.record(READ,data)
+        return data
+
+    @property
+    def in_waiting(self):
+        return self.ser.in_waiting
+
+    def close(self):
+        self.ser.close()
+        self.trace.close()
+
+    def __getattr__(self,name):
+        return getattr(self.ser,name)
+
+
+class Replayer(object):
+    """a fake engraver answering like the device of a trace. Every write is
+    matched with the next recorded write of the same command; the reads that
+    followed it are replayed with their recorded delays divided by speed. A write
+    with no match left gets the last answer recorded for its command"""
+
+    def __init__(self,path,speed=1.,timeout=None):
+        self.speed=speed
+        self.timeout=timeout
+        self.is_open=True
+        self.buf=bytearray()
+        self.cond=threading.Condition()
+        self.due=[] # (time,seq,data) heap of scheduled reads
+        self.seq=0
+        self.mismatches=0
+        self.exchanges=[]
+        self.last={}
+        records=readTrace(path)
+        for i,(kind,t,data) in enumerate(records):
+            if kind!=WRITE or not data:
+                continue
+            replies=[]
+            for k,rt,rdata in records[i+1:]:
+                if k==WRITE:
+                    break
+                replies.append((rt-t,rdata))
+            self.exchanges.append((data,replies))
+        self.pos=0
+        threading.Thread(target=self._deliver,daemon=True).start()
+
+    def _next(self,data):
+        for i in range(self.pos,len(self.exchanges)):
+            if self.exchanges[i][0][:1]==data[:1]:
+                if i!=self.pos or self.exchanges[i][0]!=data:
+                    self.mismatches+=1
+                self.pos=i+1
+                replies=self.exchanges[i][1]
+                self.last[data[:1]]=replies
+                return replies
+        self.mismatches+=1
+        return self.last.get(data[:1],[])
+
+    def write(self,data):
+        data=bytes(data)
+        now=time.monotonic()
+        with self.cond:
+            for delay,reply in self._next(data):
+                self.seq+=1
+                heapq.heappush(self.due,(now+delay/self.speed,self.seq,reply))
+            self.cond.notify_all()
+        return len(data)
+
+    def _deliver(self):
+        with self.cond:
+            while self.is_open:
+                now=time.monotonic()
+                while self.due and self.due[0][0]<=now:
+                    self.buf+=heapq.heappop(self.due)[2]
+                    self.cond.notify_all()
+                self.cond.wait(self.due[0][0]-now if self.due else None)
+
+    @property
+    def in_waiting(self):
+        return len(self.buf)
+
+    def read(self,size=1):
+        end=time.monotonic()+(self.timeout or 0)
+        with self.cond:
+            while len(self.buf)<size and self.is_open:
+                rest=end-time.monotonic()
+                if rest<=0:
+                    break
+                self.cond.wait(rest)
+            data=bytes(self.buf[:size])
+            del self.buf[:size]
+            return data
+
+    def close(self):
+        with self.cond:
+            self.is_open=False
+            self.cond.notify_all()
+
+
+def openDevice(device,speed,record=None):
+    """opens the serial device or the replay of a trace given as replay:<file>;
+    the traffic is recorded to the file record if given"""
+    if device.startswith(REPLAY_PREFIX):
+        ser=Replayer(device[len(REPLAY_PREFIX):],timeout=0.1)
+    else:
+        import serial
+        ser=serial.Serial(device,speed,timeout=0.1)
+    if record:
+        ser=Recorder(ser,record)
+    return ser
+
+########################################################################
+
+def percentile(values,p):
+    if not values:
+        return 0.
+    values=sorted(values)
+    return values[min(len(values)-1,int(len(values)*p))]
+
+def analyze(records,baud=115200,newbaud=None):
+    """splits a trace into its exchanges and estimates the time of the transfers
+    at another baud rate: the time on the wire (10 bits per byte) is replaced,
+    the response time of the engraver is kept"""
+    newbaud=newbaud or baud
+    writes=0
+    reads=0
+    latencies=[]
+    pending=None
+    total=records[-1][1] if records else 0.
+    retimed=total
+    for i,(kind,t,data) in enumerate(records):
+        if kind==WRITE:
+            writes+=len(data)
+            # the wire time cannot have been longer than the wait for the next record
+            gap=records[i+1][1]-t if i+1<len(records) else 0.
+            retimed+=max(-gap,len(data)*10.*(1./newbaud-1./baud))
+            pending=(t,data)
+        else:
+            reads+=len(data)
+            if pending and data[:1]==b'\x09':
+                latencies.append(t-pending[0])
+            pending=None
+    return {'records':len(records),'written':writes,'read':reads,'duration':total,
+            'acks':len(latencies),'ack p50':percentile(latencies,0.5),'ack p99':percentile(latencies,0.99),
+            'retimed':retimed}
+
+def dump(records,out=sys.stdout):
+    for kind,t,data in records:
+        out.write("%10.6f %s %s\n"%(t,chr(kind),data.hex(' ')))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='inspects traces of the serial traffic recorded with --record',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('command',choices=['info','dump'],help='info: summary and re-timing of the trace; dump: all records')
+    parser.add_argument('trace',help='the trace file')
+    parser.add_argument('-s','--speed',metavar='baud',type=int,default=115200,help='the baud rate of the trace')
+    parser.add_argument('--retime',metavar='baud',type=int,default=None,help='estimate the duration at another baud rate')
+    opts=parser.parse_args()
+    records=readTrace(opts.trace)
+    if opts.command=='dump':
+        dump(records)
+    else:
+        res=analyze(records,opts.speed,opts.retime)
+        for k in ('records','written','read','acks'):
+            print("%-10s %d"%(k,res[k]))
+        for k in ('ack p50','ack p99'):
+            print("%-10s %.2f ms"%(k,res[k]*1000.))
+        print("%-10s %.2f secs"%('duration',res['duration']))
+        if opts.retime:
+            print("%-10s %.2f secs at %d baud"%('retimed',res['retimed'],opts.retime))
@@ -0,0 +1,38 @@
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engraver import Logger
+
+Logger.set(Logger(-3))
+
+
+@pytest.fixture
+def fontfile(tmp_path_factory):
+    """a truetype font file: the default font bundled with Pillow"""
+    from PIL import ImageFont
+    font=ImageFont.load_default(20)
+    if not hasattr(getattr(font,'path',None),'getvalue'):
+        pytest.skip("Pillow has no bundled truetype font")
+    path=tmp_path_factory.mktemp('font')/'Default.ttf'
+    path.write_bytes(font.path.getvalue())
+    return path
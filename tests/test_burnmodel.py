@@ -0,0 +1,61 @@
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import json
+import random
+
+import pytest
+
+from engraver import BurnModel, solve
+
+
+def test_solve():
+    x=solve([[2.,1.,-1.],[-3.,-1.,2.],[-2.,1.,2.]],[8.,-11.,-3.])
+    assert x==pytest.approx([2.,3.,-1.])
+    assert solve([[0.,1.],[1.,0.]],[2.,3.])==pytest.approx([3.,2.])
+    assert solve([[1.,2.],[2.,4.]],[1.,2.])==None
+
+def test_defaults_without_history(tmp_path):
+    model=BurnModel(str(tmp_path/'history.jsonl'))
+    assert model.transfer==BurnModel.TRANSFER[1] and model.burn==BurnModel.BURN[1]
+
+def jobs(n,rnd):
+    for _ in range(n):
+        stats={'rows':rnd.randint(10,1600),'bytes':rnd.randint(1000,400000),'dark':rnd.randint(0,500000),
+               'depth':rnd.randint(1,100),'power':rnd.randint(1,100),'runs':rnd.randint(0,50000)}
+        yield stats,1.+0.004*stats['rows']+0.0001*stats['bytes'],5.+0.03*stats['rows']+0.00003*stats['dark']*stats['depth']+0.001*stats['runs']
+
+def test_fit_from_recorded_jobs(tmp_path):
+    history=str(tmp_path/'history.jsonl')
+    model=BurnModel(history)
+    rnd=random.Random(2)
+    for stats,transfer,burn in jobs(40,rnd):
+        model.record(stats,transfer,burn)
+    for stats,transfer,burn in jobs(10,rnd):
+        assert model.estimate(stats)==pytest.approx((transfer,burn),rel=0.05)
+    # the history is reloaded with the same fit
+    with open(history,'a') as fd:
+        fd.write('not json\n')
+    again=BurnModel(history)
+    assert len(again.jobs)==40
+    assert again.transfer==pytest.approx(model.transfer) and again.burn==pytest.approx(model.burn)
+    assert json.loads(open(history).readline())['transfer']>0
+
+def test_estimate_is_never_negative():
+    model=BurnModel()
+    model.transfer=(-10.,0.,0.)
+    stats={'rows':1,'bytes':1,'dark':0,'depth':1,'power':1,'runs':0}
+    assert model.estimate(stats)[0]==0.
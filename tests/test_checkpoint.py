@@ -0,0 +1,75 @@
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import random
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from engraver import Checkpoint, EngraverData
+
+ARGS=SimpleNamespace(lim=1575,depth=10,power=50,invert=False)
+
+def job(seed,height=50):
+    rnd=random.Random(seed)
+    im=Image.new('1',(40,height))
+    im.putdata([rnd.choice((0,255)) for _ in range(40*height)])
+    return EngraverData.fromBitmap(im,ARGS)
+
+def interrupted(path,jobs,percent):
+    cp=Checkpoint(path)
+    for data in jobs[:-1]:
+        cp.start(data)
+        cp.progress(data,len(data.rows),100)
+    cp.start(jobs[-1])
+    cp.progress(jobs[-1],len(jobs[-1].rows),percent)
+
+def test_resume_skips_burned_jobs_and_rows(tmp_path):
+    path=str(tmp_path/'checkpoint.json')
+    jobs=[job(1),job(2),job(3)]
+    interrupted(path,jobs[:2],40)
+    rest=list(Checkpoint(path,resume=True).remaining([job(1),job(2),job(3)]))
+    assert len(rest)==2
+    assert rest[0].skipped==20 and rest[0].rows==jobs[1].rows[20:]
+    assert rest[0].size()==(40,30) and rest[0].offset==(0,20)
+    assert rest[1].skipped==0 and rest[1].rows==jobs[2].rows
+
+def test_resumed_job_keeps_its_checkpoint(tmp_path):
+    path=str(tmp_path/'checkpoint.json')
+    interrupted(path,[job(1)],40)
+    cp=Checkpoint(path,resume=True)
+    data=next(cp.remaining([job(1)]))
+    cp.start(data)
+    cp.progress(data,10,50)
+    # interrupted again: the rows are counted from the start of the job
+    again=next(Checkpoint(path,resume=True).remaining([job(1)]))
+    assert again.skipped==35 and again.rows==job(1).rows[35:]
+
+def test_completed_job_is_skipped(tmp_path):
+    path=str(tmp_path/'checkpoint.json')
+    interrupted(path,[job(1),job(2)],100)
+    assert list(Checkpoint(path,resume=True).remaining([job(1),job(2)]))==[]
+
+def test_other_job_is_rejected(tmp_path):
+    path=str(tmp_path/'checkpoint.json')
+    interrupted(path,[job(1)],40)
+    with pytest.raises(SystemExit):
+        list(Checkpoint(path,resume=True).remaining([job(4)]))
+
+def test_missing_checkpoint(tmp_path):
+    with pytest.raises(SystemExit):
+        Checkpoint(str(tmp_path/'none.json'),resume=True)
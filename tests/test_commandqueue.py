@@ -0,0 +1,62 @@
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import threading
+
+import gui
+
+
+def cmds(queue):
+    out=[]
+    while queue.entries:
+        out.append(queue.get()[0]['cmd'])
+    return out
+
+def put(queue,*names):
+    return [queue.put(({'cmd':name},None)) for name in names]
+
+def test_urgent_commands_first_then_in_order():
+    queue=gui.CommandQueue()
+    put(queue,'move','home','stopEngraving','fan')
+    assert cmds(queue)==['stopEngraving','move','home','fan']
+
+def test_status_requests_are_merged():
+    queue=gui.CommandQueue()
+    put(queue,'status','move','nop','status')
+    assert cmds(queue)==['status','move']
+
+def test_full_queue_rejects_but_keeps_urgent_commands():
+    queue=gui.CommandQueue(2)
+    assert put(queue,'move','move','move','stopEngraving')==[True,True,False,True]
+    assert cmds(queue)==['stopEngraving','move','move']
+
+def test_frame_stop_never_overtakes_its_start():
+    queue=gui.CommandQueue()
+    put(queue,'move','frameStart','frameStop')
+    assert cmds(queue)==['move','status']
+    put(queue,'frameStart')
+    queue.get()
+    put(queue,'frameStop','move')
+    assert cmds(queue)==['frameStop','move']
+
+def test_get_waits_for_a_command():
+    queue=gui.CommandQueue()
+    got=[]
+    t=threading.Thread(target=lambda: got.append(queue.get()))
+    t.start()
+    put(queue,'home')
+    t.join(1)
+    assert got[0][0]['cmd']=='home'
@@ -0,0 +1,63 @@
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import zlib
+
+import gui
+
+
+class Registry(object):
+    def Register(self,client):
+        pass
+
+    def Traffic(self,raw=0,sent=0):
+        pass
+
+
+def websocket(deflate):
+    return gui.Websocket(None,Registry(),deflate=deflate)
+
+def inflate(inflater,data):
+    return inflater.decompress(data+gui.DEFLATE_TAIL)
+
+def test_negotiate():
+    assert gui.NegotiateDeflate(None)==None
+    assert gui.NegotiateDeflate('x-webkit-deflate-frame')==None
+    assert gui.NegotiateDeflate('permessage-deflate; client_max_window_bits')=={}
+    assert gui.NegotiateDeflate('permessage-deflate; server_max_window_bits=8, permessage-deflate; server_no_context_takeover')=={'server_no_context_takeover':''}
+    assert gui.NegotiateDeflate('permessage-deflate; server_max_window_bits="10"')=={'server_max_window_bits':'10'}
+    assert gui.NegotiateDeflate('permessage-deflate; unknown=1')==None
+
+def test_extension_header():
+    params={'server_no_context_takeover':'','server_max_window_bits':'10'}
+    assert gui.DeflateExtension(params)=='permessage-deflate; server_no_context_takeover; server_max_window_bits=10'
+    assert gui.NegotiateDeflate(gui.DeflateExtension(params))==params
+
+def test_messages_share_the_context():
+    ws=websocket({})
+    inflater=zlib.decompressobj(-15)
+    msgs=[b'{"status":"idle","progress":%d}'%i*20 for i in range(5)]
+    sizes=[]
+    for msg in msgs:
+        data=ws.Deflate(msg)
+        sizes.append(len(data))
+        assert inflate(inflater,data)==msg
+    assert sizes[-1]<sizes[0]
+
+def test_no_context_takeover_and_small_window():
+    ws=websocket({'server_no_context_takeover':'','server_max_window_bits':'9'})
+    for msg in (b'a'*1000,b'b'*3000,b''):
+        assert inflate(zlib.decompressobj(-9),ws.Deflate(msg))==msg
@@ -0,0 +1,66 @@
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import json
+import shutil
+import time
+
+from PIL import ImageFont
+
+import gui
+
+
+def test_snapshot_does_not_wait_for_the_first_scan(tmp_path):
+    index=gui.FontIndex(str(tmp_path))
+    start=time.monotonic()
+    etag,body=index.snapshot() # the scan thread is not even started
+    assert time.monotonic()-start<index.WAIT+0.2
+    assert etag and body=='[]'
+
+def test_scan_lists_fonts_and_saves_the_index(tmp_path,fontfile):
+    shutil.copy(fontfile,tmp_path/'a.ttf')
+    (tmp_path/'readme.txt').write_text('not a font')
+    index=gui.FontIndex(str(tmp_path))
+    index.scan()
+    etag,body=index.snapshot()
+    assert json.loads(body)==[{'name':'Aileron (Regular)','file':'a.ttf'}]
+    assert 'a.ttf' in json.loads((tmp_path/index.INDEXFILE).read_text())
+    # a new index loads the saved entries without scanning
+    again=gui.FontIndex(str(tmp_path))
+    assert again.snapshot()==(etag,body)
+
+def test_scan_only_opens_changed_files(tmp_path,fontfile,monkeypatch):
+    shutil.copy(fontfile,tmp_path/'a.ttf')
+    index=gui.FontIndex(str(tmp_path))
+    index.scan()
+    etag=index.snapshot()[0]
+    opened=[]
+    monkeypatch.setattr(ImageFont,'truetype',lambda path: opened.append(path))
+    index.scan()
+    assert opened==[] and index.snapshot()[0]==etag
+    shutil.copy(fontfile,tmp_path/'b.ttf')
+    monkeypatch.undo()
+    index.scan()
+    assert [f['file'] for f in json.loads(index.snapshot()[1])]==['a.ttf','b.ttf']
+    assert index.snapshot()[0]!=etag
+
+def test_broken_fonts_are_not_listed_or_saved(tmp_path,fontfile):
+    shutil.copy(fontfile,tmp_path/'a.ttf')
+    (tmp_path/'broken.ttf').write_bytes(b'not a font')
+    index=gui.FontIndex(str(tmp_path))
+    index.scan()
+    assert [f['file'] for f in json.loads(index.snapshot()[1])]==['a.ttf']
+    assert list(json.loads((tmp_path/index.INDEXFILE).read_text()))==['a.ttf']
@@ -0,0 +1,59 @@
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import threading
+
+from engraver import Metrics
+
+
+def samples(text):
+    return dict(l.rsplit(' ',1) for l in text.splitlines() if not l.startswith('#'))
+
+def test_counters_from_all_threads_are_summed():
+    metrics=Metrics()
+    def count():
+        for _ in range(1000):
+            metrics.inc('kkengraver_rows_sent_total')
+        metrics.inc('kkengraver_serial_bytes_total',123456789,direction='out')
+    threads=[threading.Thread(target=count) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    text=metrics.export()
+    assert '# TYPE kkengraver_rows_sent_total counter' in text
+    s=samples(text)
+    assert s['kkengraver_rows_sent_total']=='4000'
+    assert s['kkengraver_serial_bytes_total{direction="out"}']=='493827156' # not rounded like %g
+
+def test_histogram():
+    metrics=Metrics()
+    for v in (0.0001,0.003,0.003,100.):
+        metrics.observe('kkengraver_ack_seconds',v,cmd='move')
+    s=samples(metrics.export())
+    assert s['kkengraver_ack_seconds_bucket{cmd="move",le="0.0005"}']=='1'
+    assert s['kkengraver_ack_seconds_bucket{cmd="move",le="0.005"}']=='3'
+    assert s['kkengraver_ack_seconds_bucket{cmd="move",le="+Inf"}']=='4'
+    assert s['kkengraver_ack_seconds_count{cmd="move"}']=='4'
+    assert float(s['kkengraver_ack_seconds_sum{cmd="move"}'])==0.0001+0.003+0.003+100.
+
+def test_labels_are_escaped_and_gauges_exported():
+    metrics=Metrics()
+    metrics.inc('kkengraver_burns_total',result='a"b\\c')
+    metrics.gauge('kkengraver_sessions',lambda: 3,'open sessions')
+    s=samples(metrics.export())
+    assert s['kkengraver_burns_total{result="a\\"b\\\\c"}']=='1'
+    assert s['kkengraver_sessions']=='3'
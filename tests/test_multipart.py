@@ -0,0 +1,61 @@
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import io
+import os
+
+import pytest
+
+import gui
+
+BOUNDARY='----formboundary42'
+
+def body(*parts,preamble=b''):
+    out=preamble
+    for name,data in parts:
+        out+=b'--'+BOUNDARY.encode()+b'\r\n'
+        out+=b'Content-Disposition: form-data; name="%s"; filename="x.png"\r\n'%name.encode()
+        out+=b'Content-Type: application/octet-stream\r\n\r\n'+data+b'\r\n'
+    return out+b'--'+BOUNDARY.encode()+b'--\r\n'
+
+def read(data,name='file',chunk=7):
+    reader=gui.MultipartReader(io.BytesIO(data),BOUNDARY,len(data))
+    reader.CHUNK=chunk
+    return reader.read(name)
+
+@pytest.mark.parametrize('chunk',[1,7,65536])
+def test_reads_the_named_part(chunk):
+    data=os.urandom(5000)+b'\r\n--'+BOUNDARY.encode()[:-1]+b'\r\n'
+    fd=read(body(('other',b'skip me'),('file',data),('last',b'x')),chunk=chunk)
+    assert fd.read()==data
+
+def test_consumes_the_whole_body():
+    data=body(('file',b'abc'),preamble=b'ignored\r\n')+b'epilogue'
+    rfile=io.BytesIO(data)
+    fd=gui.MultipartReader(rfile,BOUNDARY,len(data)).read('file')
+    assert fd.read()==b'abc' and rfile.tell()==len(data)
+
+def test_missing_part_gives_none():
+    assert read(body(('other',b'abc')))==None
+
+def test_truncated_body_is_an_error():
+    with pytest.raises(ValueError):
+        read(body(('file',b'abc'*100))[:-60])
+
+def test_oversized_part_header_is_an_error():
+    data=b'--'+BOUNDARY.encode()+b'\r\nX-Pad: '+b'x'*(gui.MultipartReader.MAXHEADER+10)
+    with pytest.raises(ValueError):
+        read(data,chunk=4096)
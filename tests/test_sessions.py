@@ -0,0 +1,36 @@
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import gui
+
+
+def test_least_recently_used_sessions_are_evicted():
+    sessions=gui.Sessions(2)
+    a=sessions.get(None)
+    b=sessions.get(None)
+    assert sessions.get(a.id) is a
+    c=sessions.get('unknown')
+    assert c.id!='unknown'
+    assert list(sessions.entries)==[a.id,c.id]
+
+def test_sessions_with_websockets_are_kept():
+    sessions=gui.Sessions(1)
+    a=sessions.get(None)
+    a.websockets.add(object())
+    b=sessions.get(None)
+    assert list(sessions.entries)==[a.id,b.id]
+    c=sessions.get(None)
+    assert list(sessions.entries)==[a.id,c.id]
@@ -0,0 +1,44 @@
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import random
+
+from engraver import EngraverData
+
+
+def overlap(a,b):
+    return a[0]<b[0]+b[2] and b[0]<a[0]+a[2] and a[1]<b[1]+b[3] and b[1]<a[1]+a[3]
+
+def test_random_rectangles_fit_and_do_not_overlap():
+    rnd=random.Random(1)
+    for _ in range(200):
+        width,height=rnd.randint(10,300),rnd.randint(10,300)
+        sizes=[(rnd.randint(1,120),rnd.randint(1,120)) for _ in range(rnd.randint(1,15))]
+        placed=[]
+        for (w,h),p in zip(sizes,EngraverData._skyline(sizes,width,height)):
+            if p==None:
+                continue
+            x,y=p
+            assert 0<=x and x+w<=width and 0<=y and y+h<=height
+            assert not any(overlap((x,y,w,h),r) for r in placed)
+            placed.append((x,y,w,h))
+
+def test_exact_fit():
+    pos=EngraverData._skyline([(50,50)]*4,100,100)
+    assert sorted(pos)==[(0,0),(0,50),(50,0),(50,50)]
+
+def test_rectangles_which_do_not_fit_are_none():
+    assert EngraverData._skyline([(40,40),(101,10),(10,101)],100,100)==[(0,0),None,None]
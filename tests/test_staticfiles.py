@@ -0,0 +1,62 @@
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import gzip
+import os
+
+import gui
+
+
+def test_compressed_variants_and_revalidation(tmp_path):
+    path=tmp_path/'main.js'
+    path.write_text('var x=1;\n'*200)
+    files=gui.StaticFiles(str(tmp_path))
+    e=files.get(str(path),'application/javascript')
+    data,etag=e['variants']['identity']
+    assert data==path.read_bytes() and e['cache']=="no-cache"
+    assert gzip.decompress(e['variants']['gzip'][0])==data
+    assert e['variants']['gzip'][1]!=etag
+    assert files.get(str(path),'application/javascript') is e
+    path.write_text('var y=2;\n'*201)
+    assert files.get(str(path),'application/javascript')['variants']['identity'][0]==path.read_bytes()
+
+def test_small_and_binary_files_are_not_compressed(tmp_path):
+    (tmp_path/'a.css').write_text('a{}')
+    (tmp_path/'b.png').write_bytes(os.urandom(1000))
+    files=gui.StaticFiles(str(tmp_path))
+    assert list(files.get(str(tmp_path/'a.css'),'text/css')['variants'])==['identity']
+    assert list(files.get(str(tmp_path/'b.png'),'image/png')['variants'])==['identity']
+
+def test_hashed_names_are_immutable(tmp_path):
+    path=tmp_path/'main.0123456789abcdef0123.js'
+    path.write_text('x')
+    assert 'immutable' in gui.StaticFiles(str(tmp_path)).get(str(path),'application/javascript')['cache']
+
+def test_encoding_honours_accept_encoding(tmp_path):
+    path=tmp_path/'index.html'
+    path.write_text('<p>hello</p>\n'*100)
+    e=gui.StaticFiles(str(tmp_path)).get(str(path),'text/html')
+    assert gui.StaticFiles.encoding(e,'gzip, deflate')=='gzip'
+    assert gui.StaticFiles.encoding(e,'gzip;q=0, deflate')=='identity'
+    assert gui.StaticFiles.encoding(e,None)=='identity'
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    files=gui.StaticFiles(str(tmp_path),maxsize=2500)
+    for name in 'abc':
+        (tmp_path/name).write_bytes(os.urandom(1000))
+        files.get(str(tmp_path/name),'image/png')
+    assert list(files.files)==[str(tmp_path/'b'),str(tmp_path/'c')]
+    assert files.total==2000
@@ -0,0 +1,42 @@
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+from types import SimpleNamespace
+
+import pytest
+
+from engraver import EngraverData
+
+
+def textArgs(fontfile,text,size):
+    return SimpleNamespace(font=str(fontfile),text=text,size=size,lim=1575)
+
+@pytest.mark.parametrize('text',['Hello','KKMoon\nengraver','i'])
+@pytest.mark.parametrize('size',[(400,100),(100,400),(1575,1575),(60,24)])
+def test_text_fills_the_engraving_size(fontfile,text,size):
+    im=EngraverData.imageFromText(textArgs(fontfile,text,size))
+    assert im.mode=='L'
+    assert im.width<=size[0] and im.height<=size[1]
+    # the font size is the largest one fitting, so one side is nearly filled
+    assert im.width>=size[0]*0.9 or im.height>=size[1]*0.9
+    # cropped to the inked pixels
+    assert im.getbbox() and im.crop((0,0,1,im.height)).getextrema()[0]<128
+
+def test_lines_are_spaced_by_the_measured_pitch(fontfile):
+    one=EngraverData.imageFromText(textArgs(fontfile,'X',(100,1575)))
+    two=EngraverData.imageFromText(textArgs(fontfile,'X\nX',(100,1575)))
+    assert two.width==one.width
+    assert two.height>one.height*2
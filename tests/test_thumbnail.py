@@ -0,0 +1,40 @@
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import random
+from types import SimpleNamespace
+
+from PIL import Image
+
+from engraver import EngraverData, imageTrf
+
+
+def test_thumbnail_size_matches_pillow():
+    rnd=random.Random(3)
+    for _ in range(1000):
+        size=(rnd.randint(1,3000),rnd.randint(1,3000))
+        maxsize=(rnd.uniform(1,2000),rnd.uniform(1,2000)) if rnd.random()<0.5 else (rnd.randint(1,2000),rnd.randint(1,2000))
+        im=Image.new('1',size)
+        im.thumbnail(maxsize)
+        assert EngraverData._thumbnailSize(size,maxsize)==im.size,(size,maxsize)
+
+def test_image_frame_reads_only_the_size(tmp_path):
+    path=str(tmp_path/'a.png')
+    Image.new('L',(300,200)).save(path)
+    args=SimpleNamespace(image=path,size=(150,150),trf=[imageTrf('cw')])
+    assert EngraverData.imageFrame(args)==(100,150)
+    args.trf=None
+    assert EngraverData.imageFrame(args)==(150,100)
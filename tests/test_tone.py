@@ -0,0 +1,68 @@
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import random
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image, ImageEnhance, ImageOps
+
+from engraver import EngraverData, toneTable
+
+
+def tone(contrast=None,brightness=None,gamma=None,levels=None):
+    return SimpleNamespace(contrast=contrast,brightness=brightness,gamma=gamma,levels=levels)
+
+def photo(seed):
+    rnd=random.Random(seed)
+    lo,hi=sorted((rnd.randint(0,255),rnd.randint(0,255)))
+    im=Image.new('L',(64,48))
+    im.putdata([rnd.randint(lo,hi) for _ in range(64*48)])
+    return im
+
+@pytest.mark.parametrize('seed',range(5))
+def test_contrast_and_brightness_match_image_enhance(seed):
+    rnd=random.Random(seed)
+    im=photo(seed)
+    for _ in range(20):
+        contrast,brightness=rnd.choice((None,rnd.uniform(0.,4.))),rnd.choice((None,rnd.uniform(0.,4.)))
+        expected=im
+        if contrast!=None:
+            expected=ImageEnhance.Contrast(expected).enhance(contrast)
+        if brightness!=None:
+            expected=ImageEnhance.Brightness(expected).enhance(brightness)
+        result=EngraverData._enhanceImage(im,tone(contrast,brightness))
+        assert result.tobytes()==expected.tobytes(),(contrast,brightness)
+
+@pytest.mark.parametrize('seed',range(5))
+@pytest.mark.parametrize('cutoff',[0,0.5,2])
+def test_auto_levels_match_autocontrast(seed,cutoff):
+    im=photo(seed)
+    expected=ImageOps.autocontrast(im,cutoff=cutoff)
+    assert EngraverData._enhanceImage(im,tone(levels=cutoff)).tobytes()==expected.tobytes()
+
+def test_gamma():
+    lut=toneTable(None,None,2.,0,255,None)
+    assert lut[0]==0 and lut[255]==255 and lut[64]==128
+    assert toneTable(None,None,None,0,255,None)==list(range(256))
+
+def test_no_adjustment_returns_the_image():
+    im=photo(0)
+    assert EngraverData._enhanceImage(im,tone()) is im
+
+def test_auto_levels_of_a_flat_image():
+    im=Image.new('L',(8,8),100)
+    assert EngraverData._enhanceImage(im,tone(levels=0.5)).tobytes()==ImageOps.autocontrast(im,cutoff=0.5).tobytes()
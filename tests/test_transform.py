@@ -0,0 +1,51 @@
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import itertools
+import random
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from engraver import EngraverData, imageTrf
+
+NAMES=('cw','ccw','turn','tb','lr')
+
+def bitmap(width,height,seed=4):
+    rnd=random.Random(seed)
+    im=Image.new('1',(width,height))
+    im.putdata([rnd.choice((0,255)) for _ in range(width*height)])
+    return im
+
+def test_composed_transforms_match_chained_transpose():
+    im=bitmap(13,7)
+    for n in range(4):
+        for names in itertools.product(NAMES,repeat=n):
+            trf=[imageTrf(name) for name in names]
+            expected=im
+            for t in trf:
+                expected=expected.transpose(t[1])
+            result=EngraverData._trfImage(im,SimpleNamespace(trf=trf))
+            assert (result.size,result.tobytes())==(expected.size,expected.tobytes()),names
+
+@pytest.mark.parametrize('width',[1,8,13,16,21])
+@pytest.mark.parametrize('inv',[False,True])
+@pytest.mark.parametrize('flip',['lr','tb','turn'])
+def test_packed_flips_match_transpose(width,inv,flip):
+    im=bitmap(width,5,seed=width)
+    expected=list(EngraverData._packRows(im.transpose(imageTrf(flip)[1]),inv))
+    assert list(EngraverData._packRows(im,inv,flip))==expected
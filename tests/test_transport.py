@@ -0,0 +1,96 @@
+########################################################################
+# Copyright 2019 Bernd Breitenbach
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+#
+########################################################################
+
+import queue
+from types import SimpleNamespace
+
+import pytest
+
+from engraver import Base, Engraver, SerialTransport
+
+
+class FakeSerial(object):
+    """a serial device answering from a queue of responses"""
+    def __init__(self):
+        self.incoming=queue.Queue()
+        self.written=[]
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def read(self,size):
+        try:
+            return self.incoming.get(timeout=0.05)
+        except queue.Empty:
+            return b''
+
+    def write(self,data):
+        self.written.append(data)
+
+
+@pytest.fixture
+def transport():
+    t=SerialTransport(FakeSerial())
+    yield t
+    t.close()
+
+def test_responses_resolve_requests_in_order(transport):
+    first=transport.request(b'a',1)
+    second=transport.request(b'b',4)
+    transport.ser.incoming.put(b'\x09\x01\x02')
+    transport.ser.incoming.put(b'\x03\x04')
+    assert first.result(1)==b'\x09' and second.result(1)==b'\x01\x02\x03\x04'
+    assert transport.write(b'c').result(1)==1
+    assert transport.ser.written==[b'a',b'b',b'c']
+
+def test_frames_while_burning(transport):
+    transport.framing=True
+    ack=transport.request(b'row',1)
+    transport.ser.incoming.put(b'\xff\x00\x00\x32'+Base.ACK)
+    assert ack.result(1)==Base.ACK
+    assert transport.frames.get(timeout=1)==b'\xff\x00\x00\x32'
+
+def test_cancelled_request_does_not_take_the_next_answer(transport):
+    lost=transport.request(b'a',4)
+    transport.ser.incoming.put(b'\x01\x02')
+    with pytest.raises(Exception):
+        lost.result(0.2)
+    transport.cancel(lost)
+    assert lost.cancelled() and not transport.pending
+    answer=transport.request(b'b',1)
+    transport.ser.incoming.put(Base.ACK)
+    assert answer.result(1)==Base.ACK
+
+def test_timeout_cancels_the_request(transport,monkeypatch):
+    engraver=Engraver(SimpleNamespace(lim=1575,device=None,speed=None,record=None))
+    engraver.transport=transport
+    monkeypatch.setattr(Engraver,'TIMEOUT',0.1)
+    with pytest.raises(SystemExit):
+        engraver.send(b'a')
+    assert not transport.pending
+
+def test_interrupt_only_while_burning(transport):
+    engraver=Engraver(SimpleNamespace(lim=1575,device=None,speed=None,record=None))
+    engraver.transport=transport
+    engraver.interrupt()
+    transport.ser.incoming.put(Base.ACK)
+    engraver.send(b'a') # not interrupted
+    engraver.burning=True
+    engraver.interrupt()
+    with pytest.raises(KeyboardInterrupt):
+        engraver.send(b'a')
+    assert not engraver.interrupted.is_set()